@@ -9,6 +9,7 @@ from bson.objectid import ObjectId
 from datetime import datetime, timedelta
 from getpass import getpass
 import librarium
+from pymongo.errors import OperationFailure
 import re
 from tabulate import tabulate
 
@@ -44,6 +45,10 @@ try:
         loans = LOANS,
         library = LIBRARY
     )
+    biblio.enable_cache(
+        size = 256,
+        ttl = 30
+    )
 except TypeError as e:
     print("CRITICAL ERROR: One of the variables in env.py is not a string.")
     print("Make sure all the values for each variable is enclosed with 2")
@@ -59,6 +64,20 @@ except Exception as e:
 else:
     print("\nConnected to your library cluster.\n")
 
+if run:
+    try:
+        biblio.ensure_indexes()
+    except OperationFailure as e:
+        print("WARNING: Could not build the indexes of your library.")
+        conflicts = biblio.username_conflicts()
+        if len(conflicts) != 0:
+            print("These usernames only differ in case. Rename or delete all")
+            print("but one of each before the next start:")
+            for usernames in conflicts:
+                print("    " + ", ".join(usernames))
+        else:
+            print(e)
+
 
 # LOCAL GLOBALS
 
@@ -106,6 +125,10 @@ delete book: Delete a book. Must be logged in as Admin.
 edit book: Edit the information about a book. Must be logged in as Admin.
 
 who borrowed: Find out who borrowed a book. Must be logged in as Admin.
+
+overdue loans: List loans past their end date. Must be logged in as Admin.
+
+repair library: Rebuild copy counts and loan counters from the loans. Run once after upgrading, while no one is borrowing. Must be logged in as Admin.
 """
 
 
@@ -158,19 +181,11 @@ def user_login():
         return None
     borrower_username = input("Please enter your username |> ")
     borrower_password = getpass("Please enter your password |> ")
-    finding_id = biblio.find_borrowers(
-        username = borrower_username,
-        exact = True,
-        insensitive = False
-    )
-    if len(finding_id) == 0:
-        print("\nUsername or password is wrong.\n")
-        return None
-    data = biblio.get_borrower(objectid = finding_id[0])
-    if data["password"] != borrower_password:
+    data = biblio.authenticate(borrower_username, borrower_password)
+    if data == None:
         print("\nUsername or password is wrong.\n")
         return None
-    borrower = finding_id[0]
+    borrower = data["_id"]
     borrower_data = data
     print(f"\nWELCOME, {data['name']}!")
     return None
@@ -194,7 +209,7 @@ def user_create():
         print("\nPlease logout before creating a new account.\n")
         return None
     borrower_username = input("Select your username |> ")
-    if len(biblio.find_borrowers(borrower_username, True, False)) > 0:
+    if biblio.find_borrowers(borrower_username, True, True, 1) != []:
         print("\nAnother borrower with the same username already exists.\n")
         return None
     borrower_password = getpass("Create a password |> ")
@@ -273,7 +288,11 @@ def user_search():
             deleted = terms.pop(item[1], item[1])
             print(f"Deleted query item: {deleted}")
         elif item[0] == "search":
-            data = biblio.search_borrowers(**terms)
+            data = biblio.search_borrowers(
+                loans = "count",
+                fields = ["username", "name"],
+                **terms
+            )
             print("\n")
             table_form = []
             for borrower in range(len(data)):
@@ -281,7 +300,7 @@ def user_search():
                     [
                         data[borrower]["username"],
                         data[borrower]["name"],
-                        len(data[borrower]["loans"]),
+                        data[borrower]["loan_count"],
                         data[borrower]["_id"]
                     ]
                 )
@@ -312,7 +331,7 @@ def user_investigate():
     except Exception as e:
         print("\nInvalid ID detected.\n")
         return None
-    data = biblio.get_borrower(oid)
+    data = biblio.get_borrower(oid, loans="count")
     if data == None:
         print("\nNobody with given ID found.\n")
         return None
@@ -325,7 +344,7 @@ def user_investigate():
                     data["phone"],
                     data["email"],
                     data["address"],
-                    len(data["loans"]),
+                    data["loan_count"],
                     data["_id"]
                 ]
             ],
@@ -353,7 +372,7 @@ def user_delete():
     if confirm != "y":
         print("\nAccount deletion aborted.\n")
         return None
-    borrower_data = biblio.get_borrower(borrower)
+    borrower_data = biblio.get_borrower(borrower, loans=None)
     print("\nHere is the data about your account that will be deleted:\n")
     print(
         tabulate(
@@ -382,7 +401,7 @@ def user_about():
     if type(borrower) != ObjectId:
         print("\nYou are not logged in yet.\n")
         return None
-    borrower_data = biblio.get_borrower(borrower)
+    borrower_data = biblio.get_borrower(borrower, loans="count")
     print("\nHere is some data on you:\n")
     print(
         tabulate(
@@ -393,7 +412,7 @@ def user_about():
                     borrower_data["phone"],
                     borrower_data["email"],
                     borrower_data["address"],
-                    len(borrower_data["loans"]),
+                    borrower_data["loan_count"],
                     borrower
                 ]
             ],
@@ -417,14 +436,19 @@ def user_loans():
     if type(borrower) != ObjectId:
         print("\nNot logged in.\n")
         return None
-    borrower_data = biblio.get_borrower(borrower)
     loans = []
-    for loan in borrower_data["loans"]:
+    data = biblio.search_loans(
+        fields = ["begin_date", "end_date"],
+        expand = {"book": ["name"]},
+        borrower = borrower,
+        returned = False
+    )
+    for loan in data:
         start = str(loan["begin_date"].year)+"/"+str(loan["begin_date"].month)+"/"+str(loan["begin_date"].day)
         end = str(loan["end_date"].year)+"/"+str(loan["end_date"].month)+"/"+str(loan["end_date"].day)
         loans.append(
             [
-                biblio.get_book(loan["book"])["name"],
+                loan["book_data"].get("name"),
                 start,
                 end,
                 loan["_id"]
@@ -453,25 +477,31 @@ def book_borrow():
     except Exception as e:
         print("\nErroneous book ID inputted.\n")
         return None
-    borrower_data = biblio.get_borrower(borrower)
-    if len(borrower_data["loans"]) >= biblio.get_meta()["quota"]:
-        print("\nYou have maxed out your account.")
-        print(f"Max books: {biblio.get_meta()['quota']}")
-        return None
-    if not biblio.book_exists(book_id):
+    meta = biblio.get_meta()
+    book_data = biblio.get_book(book_id, fields=["name", "borrowed"])
+    if book_data == None:
         print("\nBook with ID given does not exist.\n")
         return None
-    if biblio.get_book(book_id)["borrowed"]:
+    if book_data["borrowed"]:
         print("\nBook is currently held by someone else. Come back later.\n")
         return None
     begin_date = datetime.utcnow()
-    end_date = datetime.utcnow() + timedelta(days=biblio.get_meta()["period"])
-    loan = biblio.add_loan(
-        book = book_id,
-        borrower = borrower,
-        begin_date = begin_date,
-        end_date = end_date
-    )
+    end_date = datetime.utcnow() + timedelta(days=meta["period"])
+    try:
+        loan = biblio.add_loan(
+            book = book_id,
+            borrower = borrower,
+            begin_date = begin_date,
+            end_date = end_date,
+            quota = meta["quota"]
+        )
+    except librarium.QuotaError:
+        print("\nYou have maxed out your account.")
+        print(f"Max books: {meta['quota']}")
+        return None
+    if loan == None:
+        print("\nBook is currently held by someone else. Come back later.\n")
+        return None
     start = str(begin_date.year)+"/"+str(begin_date.month)+"/"+str(begin_date.day)
     end = str(end_date.year)+"/"+str(end_date.month)+"/"+str(end_date.day)
     print("\nLoan details:\n")
@@ -479,8 +509,12 @@ def book_borrow():
         tabulate(
             [
                 [
-                    biblio.get_book(book_id)["name"],
-                    biblio.get_borrower(borrower)["username"],
+                    book_data["name"],
+                    biblio.get_borrower(
+                        borrower,
+                        loans = None,
+                        fields = ["username"]
+                    )["username"],
                     start,
                     end
                 ]
@@ -508,7 +542,11 @@ def return_loan():
     if mort_id not in loans_id:
         print("\nLoan with loan ID given not found.\n")
         return None
-    details = biblio.return_loan(mort_id)
+    try:
+        details = biblio.return_loan(mort_id)
+    except ValueError:
+        print("\nLoan has already been returned.\n")
+        return None
     print("\nLoan details:\n")
     start = str(details["begin_date"].year)+"/"+str(details["begin_date"].month)+"/"+str(details["begin_date"].day)
     end = str(details["end_date"].year)+"/"+str(details["end_date"].month)+"/"+str(details["end_date"].day)
@@ -516,7 +554,7 @@ def return_loan():
         tabulate(
             [
                 [
-                    biblio.get_book(details["book"])["name"],
+                    biblio.get_book(details["book"], fields=["name"])["name"],
                     start,
                     end,
                     datetime.utcnow() > details["end_date"]
@@ -578,26 +616,37 @@ def book_search():
             for key, value in sort.items():
                 if value != 0:
                     arrange.append((key, value))
-            data = biblio.search_books(arrange, **terms)
+            data = biblio.search_books(
+                arrange,
+                fields = [
+                    "name",
+                    "isbn",
+                    "authors",
+                    "pages",
+                    "copies",
+                    "available_copies",
+                    "borrowed"
+                ],
+                **terms
+            )
             print("\n")
             table_form = []
             for book in range(len(data)):
                 authors = ""
                 for author in data[book]["authors"]:
                     authors += author + ";"
-                genres = ""
-                for genre in data[book]["genres"]:
-                    genres += genre + ";"
-                publishers = ""
-                for publisher in data[book]["publisher"]:
-                    publishers += publisher + ";"
+                copies = data[book].get("copies", 1)
+                available = data[book].get(
+                    "available_copies",
+                    0 if data[book]["borrowed"] else copies
+                )
                 table_form.append(
                     [
                         data[book]["name"],
                         data[book]["isbn"],
                         authors,
                         data[book]["pages"],
-                        data[book]["borrowed"],
+                        f"{available}/{copies}",
                         data[book]["_id"]
                     ]
                 )
@@ -609,7 +658,7 @@ def book_search():
                         "ISBN",
                         "Authors",
                         "Pages",
-                        "Borrowed",
+                        "Available",
                         "ID"
                     ],
                     tablefmt = "orgtbl"
@@ -645,6 +694,7 @@ def book_add():
     )
     book_pages = input("Input number of pages |> ")
     book_words = input("Input number of words |> ")
+    book_copies = input("Input number of copies (default 1) |> ")
     if input("Confirm details? (y/n) |> ") != "y":
         print("Book not added.")
         return None
@@ -677,6 +727,17 @@ def book_add():
             return None
     else:
         book_words = None
+    if book_copies != "":
+        try:
+            book_copies = int(book_copies)
+        except Exception as e:
+            print("\nCopies is not an integer.\n")
+            return None
+        if book_copies < 1:
+            print("\nThere must be at least 1 copy.\n")
+            return None
+    else:
+        book_copies = 1
     id = biblio.add_book(
         name = book_name,
         authors = book_authors,
@@ -685,7 +746,8 @@ def book_add():
         pages = book_pages,
         words = book_words,
         pub_date = pub_date,
-        publisher = book_publishers
+        publisher = book_publishers,
+        copies = book_copies
     )
     print(
         tabulate(
@@ -764,13 +826,14 @@ def book_update():
         return None
     edit = True
     while edit:
-        fields = ["title", "isbn", "authors", "pages"]
+        fields = ["title", "isbn", "authors", "pages", "copies"]
         print("\nSelect the integer of any field to edit or exit:")
         print("\t1: name,")
         print("\t2: isbn,")
         print("\t3: authors,")
-        print("\t4: pages")
-        print("\t5: exit")
+        print("\t4: pages,")
+        print("\t5: copies")
+        print("\t6: exit")
         field = input("\n|> ")
         try:
             field = int(field)
@@ -778,10 +841,10 @@ def book_update():
             print("\nYou did not enter an integer.\n")
             field = ""
             continue
-        if field < 1 or field > 5:
+        if field < 1 or field > 6:
             print("\nOption out of range. Try again.\n")
             continue
-        if field == 5:
+        if field == 6:
             edit = False
             continue
         location = fields[field-1]
@@ -790,13 +853,17 @@ def book_update():
         value = input("\nValue |> ")
         if field == 3:
             value = value.split(";")
-        if field == 4:
+        if field == 4 or field == 5:
             try:
                 value = int(value)
             except Exception as e:
                 print("\nValue given is not an integer.\n")
                 return None
-        biblio.update_book(book_id, **{location: value})
+        try:
+            biblio.update_book(book_id, **{location: value})
+        except ValueError as e:
+            print(f"\n{e}\n")
+            continue
         print(f"\n{fields[field-1]} edited to {value}.\n")
     print("\nEdit successful.\n")
     return None
@@ -813,17 +880,80 @@ def book_who():
     except Exception as e:
         print("\nInvalid ID inputted.\n")
         return None
-    if not biblio.book_exists(book_id):
+    book_data = biblio.get_book(book_id, fields=["name", "current_loans"])
+    if book_data == None:
         print("\nBook with ID given doesn't exist.\n")
         return None
-    data = biblio.search_loans(book=book_id, returned=False)
+    data = []
+    if book_data.get("current_loans") != []:
+        data = biblio.search_loans(
+            fields = ["borrower"],
+            expand = {"borrower": ["username"]},
+            book = book_id,
+            returned = False
+        )
     if len(data) > 0:
-        borrowed = biblio.get_borrower(data[0]["borrower"])["username"]
-        book = biblio.get_book(data[0]["book"])["name"]
-        print(tabulate([[book,borrowed]],headers = ["Name of book","Username of borrower"],tablefmt = "orgtbl"))
+        table_form = []
+        for loan in data:
+            table_form.append(
+                [book_data["name"], loan["borrower_data"].get("username")]
+            )
+        print(tabulate(table_form,headers = ["Name of book","Username of borrower"],tablefmt = "orgtbl"))
     else:
         print("\nThis book is free to borrow.\n")
 
+def loans_overdue():
+    global biblio
+    global admin
+    if not admin:
+        print("\nYou must be logged in as an admin to see overdue loans.\n")
+        return None
+    data = biblio.overdue_loans()
+    if len(data) == 0:
+        print("\nNo loans are overdue.\n")
+        return None
+    table_form = []
+    for loan in data:
+        end = loan["end_date"]
+        table_form.append(
+            [
+                loan.get("book_name"),
+                loan.get("username"),
+                loan.get("email"),
+                str(end.year)+"/"+str(end.month)+"/"+str(end.day),
+                loan["days_overdue"],
+                loan["_id"]
+            ]
+        )
+    print(
+        tabulate(
+            table_form,
+            headers = [
+                "Book Name",
+                "Borrower Username",
+                "Email",
+                "End",
+                "Days Overdue",
+                "Loan ID"
+            ],
+            tablefmt = "orgtbl"
+        )
+    )
+
+def library_repair():
+    global biblio
+    global admin
+    if not admin:
+        print("\nYou must be logged in as an admin to repair the library.\n")
+        return None
+    print("\nMake sure no one is borrowing or returning books while the repair runs.")
+    if input("Continue? (y/n) |> ") != "y":
+        print("\nRepair cancelled.\n")
+        return None
+    books = biblio.repair_availability()
+    borrowers = biblio.repair_open_loans()
+    print(f"\nRepaired {books} books and {borrowers} borrowers.\n")
+
 def assistant():
     global ASSISTANT
     print(ASSISTANT)
@@ -851,6 +981,8 @@ funcmap = {
     "delete book": book_delete,
     "edit book": book_update,
     "who borrowed": book_who,
+    "overdue loans": loans_overdue,
+    "repair library": library_repair,
     "help": assistant,
 }
 
@@ -1,15 +1,139 @@
 # Import Modules
 
+import bisect
 import bson
+import bson.json_util
+import bson.raw_bson
+import collections
+import copy
+import csv
 import datetime
 import dns
+import gzip
+import hmac
+import io
 import json
+import math
+import mmap
+import os
 import pathlib
 import pymongo
 import pprint
 import re
+import struct
+import threading
 import time
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Queries
+
+QUERY_CACHE_SIZE = 256
+
+MATCH_MODES = ["contains", "prefix", "exact"]
+
+CASE_INSENSITIVE = {"locale": "en", "strength": 2}
+
+# Indexes
+
+INDEX_VERSION = 9
+
+INDEXES = {
+    "books": [
+        {"keys": [("isbn", 1)], "name": "librarium_isbn"},
+        {"keys": [("name", 1)], "name": "librarium_name"},
+        {
+            "keys": [("name", 1)],
+            "name": "librarium_name_ci",
+            "collation": CASE_INSENSITIVE
+        },
+        {"keys": [("last_updated", 1)], "name": "librarium_last_updated"},
+        {"keys": [("available_copies", 1)], "name": "librarium_available_copies"},
+        {
+            "keys": [
+                ("name", "text"),
+                ("authors", "text"),
+                ("genres", "text"),
+                ("publisher", "text")
+            ],
+            "name": "librarium_text",
+            "weights": {"name": 10, "authors": 5, "genres": 2, "publisher": 1}
+        }
+    ],
+    "borrowers": [
+        {"keys": [("username", 1)], "name": "librarium_username", "unique": True},
+        {
+            "keys": [("username", 1)],
+            "name": "librarium_username_ci",
+            "unique": True,
+            "collation": CASE_INSENSITIVE
+        }
+    ],
+    "loans": [
+        {"keys": [("book", 1), ("returned", 1)], "name": "librarium_book_returned"},
+        {"keys": [("borrower", 1), ("returned", 1)], "name": "librarium_borrower_returned"},
+        {"keys": [("end_date", 1)], "name": "librarium_end_date"},
+        {
+            "keys": [("returned", 1), ("end_date", 1)],
+            "name": "librarium_returned_end_date"
+        }
+    ]
+}
+
+# Joins
+
+EXPAND_FIELDS = {
+    "book": ["name", "isbn", "authors"],
+    "borrower": ["username", "name", "email"]
+}
+
+# Exports
+
+CSV_FIELDS = {
+    "books": [
+        "_id",
+        "name",
+        "authors",
+        "isbn",
+        "genres",
+        "pages",
+        "words",
+        "pub_date",
+        "publisher",
+        "copies",
+        "available_copies",
+        "current_loans",
+        "last_updated"
+    ],
+    "borrowers": [
+        "_id",
+        "username",
+        "name",
+        "phone",
+        "email",
+        "address",
+        "open_loans",
+        "last_updated"
+    ],
+    "loans": [
+        "_id",
+        "book",
+        "borrower",
+        "begin_date",
+        "end_date",
+        "returned",
+        "returned_date"
+    ]
+}
+
+class QuotaError(ValueError):
+    """
+    Raised by librarium.Library.add_loan when the borrower already holds as many books as the quota allows.
+    """
+
 class Library:
     """
     A library class that acts as an intermediary between user and library data.
@@ -47,6 +171,39 @@ class Library:
 
     _library : pymongo.Collection
         MongoDB collection used to store library metadata
+
+    _index : None or librarium.SearchIndex
+        In-process search index used by local book searches
+
+    _queries : collections.OrderedDict
+        Compiled search queries, least recently used first
+
+    _cache : None or collections.OrderedDict
+        Cached get_book and get_borrower results with their expiry, least recently used first. None if caching is disabled
+
+    _cache_keys : dict of tuple, set of tuple
+        Cache keys of each book or borrower, for invalidation
+
+    _cache_size : int
+        Maximum number of cached results
+
+    _cache_ttl : float
+        Seconds a cached result stays valid
+
+    _cache_stats : dict of str, int
+        Hits, misses, evictions and invalidations since the cache was enabled
+
+    _meta : None or dict
+        Cached library metadata
+
+    _meta_fetched : float
+        time.monotonic() when _meta was fetched
+
+    _meta_stream : None or pymongo.change_stream.CollectionChangeStream
+        Change stream keeping _meta current, if watching
+
+    _meta_watcher : None or threading.Thread
+        Thread reading _meta_stream
     """
     def __init__(self):
         self._client = None
@@ -57,6 +214,17 @@ class Library:
         self._borrowers = None
         self._loans = None
         self._library = None
+        self._index = None
+        self._queries = collections.OrderedDict()
+        self._cache = None
+        self._cache_keys = {}
+        self._cache_size = 0
+        self._cache_ttl = 0
+        self._cache_stats = {}
+        self._meta = None
+        self._meta_fetched = 0.0
+        self._meta_stream = None
+        self._meta_watcher = None
 
     def __str__(self):
         return f"librarium.Library(User={self._user}, Cluster={self._cluster}) at {hex(id(self))}"
@@ -208,7 +376,7 @@ class Library:
         self._database = db
         return self
 
-    def connect_col(self, create=False, **kwargs):
+    def connect_col(self, create=False, indexes=None, **kwargs):
         """
         Connects internal attributes to library collections.
 
@@ -237,6 +405,9 @@ class Library:
         create : bool
             Whether to create a new collection if collection with specified name does not exist.
 
+        indexes : None or bool
+            Whether to create the indexes in librarium.INDEXES with librarium.Library.ensure_indexes. Follows create if None
+
         **kwargs
             books : str
             borrowers : str
@@ -282,614 +453,3387 @@ class Library:
                     ucols,
                     self._database[name]
                 )
+        if indexes == None:
+            indexes = create
+        if indexes:
+            self.ensure_indexes()
         return self
 
-    def disconnect(self):
+    def ensure_indexes(self, drop_stale=False):
         """
-        Disconnects from client.
+        Create the indexes declared in librarium.INDEXES on every connected collection.
+
+        Notes
+        -----
+        Indexes that already exist are left untouched, so this is safe to call on every start up. Creating the unique username indexes fails if borrowers with the same username already exist, ignoring case for librarium_username_ci.
+
+        Libraries created before version 7 of the catalogue have a librarium_open_loan_book index allowing only one open loan per book, which must be dropped, for example with drop_stale, before a book's copies can be lent out together.
 
         Example
         -------
 
-            >>> client.disconnect()
+            >>> client.ensure_indexes()
+            {'books': ['librarium_isbn', 'librarium_name'], ...}
+
+        Parameters
+        ----------
+        drop_stale : bool
+            Whether to also drop indexes named with the "librarium_" prefix that are no longer in the catalogue
+
+        Raises
+        ------
+        OperationFailure
+            If an index could not be built
+
+        Returns
+        -------
+        created : dict of str, list of str
+            Names of the indexes ensured on each collection
         """
-        if type(self._client) == pymongo.MongoClient:
-            self._client.close()
+        created = {}
+        for col, specs in INDEXES.items():
+            collection = getattr(self, "_" + col)
+            if collection == None:
+                continue
+            models = []
+            for spec in specs:
+                options = {k: v for k, v in spec.items() if k != "keys"}
+                models.append(pymongo.IndexModel(spec["keys"], **options))
+            if drop_stale:
+                declared = [spec["name"] for spec in specs]
+                for name in collection.index_information():
+                    if name.startswith("librarium_") and name not in declared:
+                        collection.drop_index(name)
+            created[col] = collection.create_indexes(models)
+        return created
+
+    def verify_indexes(self):
+        """
+        Compare the indexes on every connected collection against librarium.INDEXES.
 
-    # BOOKS #
+        Notes
+        -----
+        Indexes named with the "librarium_" prefix that are no longer in the catalogue are reported as stale. Indexes that have not served a single operation since the server last started are reported as unused, if the server reports index statistics.
+
+        Example
+        -------
 
-    def get_book(self, objectid):
+            >>> client.verify_indexes()
+            {'version': 1, 'missing': [('loans', 'librarium_end_date')], 'stale': [], 'unused': []}
+
+        Returns
+        -------
+        report : dict
+            version : int
+                Version of the index catalogue checked against
+            missing : list of tuple of str, str
+                Collection and name of catalogue indexes that do not exist or whose keys or collation differ
+            stale : list of tuple of str, str
+                Collection and name of librarium indexes not in the catalogue
+            unused : list of tuple of str, str
+                Collection and name of indexes with no recorded operations
         """
-        Get details of borrower with just objectid
+        report = {
+            "version": INDEX_VERSION,
+            "missing": [],
+            "stale": [],
+            "unused": []
+        }
+        for col, specs in INDEXES.items():
+            collection = getattr(self, "_" + col)
+            if collection == None:
+                continue
+            existing = collection.index_information()
+            declared = [spec["name"] for spec in specs]
+            for spec in specs:
+                info = existing.get(spec["name"])
+                if info == None:
+                    report["missing"].append((col, spec["name"]))
+                elif "weights" in info:
+                    # Text indexes list their fields as weights instead of keys
+                    if sorted(info["weights"]) != sorted(x for x, _ in spec["keys"]):
+                        report["missing"].append((col, spec["name"]))
+                elif list(info["key"]) != spec["keys"]:
+                    report["missing"].append((col, spec["name"]))
+                elif any(
+                    info.get("collation", {}).get(k) != v
+                    for k, v in spec.get("collation", {}).items()
+                ):
+                    report["missing"].append((col, spec["name"]))
+            for name in existing:
+                if name.startswith("librarium_") and name not in declared:
+                    report["stale"].append((col, name))
+            try:
+                stats = list(collection.aggregate([{"$indexStats": {}}]))
+            except pymongo.errors.OperationFailure:
+                stats = []
+            for stat in stats:
+                if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0:
+                    report["unused"].append((col, stat["name"]))
+        return report
+
+    def attach_index(self, index):
+        """
+        Attach an in-process search index used by search_books(mode="local").
 
         Example
         -------
 
-            >>> details = client.get_book(
-                bson.objectid.ObjectId("507f191e810c19729de860ea")
-            )
+            >>> client.attach_index(librarium.SearchIndex(client))
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId
-            BSON ObjectId of book
+        index : None or librarium.SearchIndex
+            Index to attach, built first if it has never been. None detaches the current index
 
         Raises
         ------
         TypeError
-            If objectid is not a BSON ObjectId
+            If index is not a librarium.SearchIndex
 
         Returns
         -------
-        details : None or dict
-            Details of the book. None if book not found
+        self : librarium.Library
         """
-        if type(objectid) != bson.objectid.ObjectId:
-            raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
-        details = self._books.find_one({"_id": objectid})
-        details["borrowed"] = self.book_borrowed(objectid)
-        return details
+        if index != None and not isinstance(index, SearchIndex):
+            raise TypeError(f"index is not a librarium.SearchIndex: {index}")
+        if index != None and index._refreshed == None:
+            index.build()
+        self._index = index
+        return self
 
-    def find_books(self, name, exact=True, insensitive=False):
+    def disconnect(self):
         """
-        Find book(s) with name.
+        Disconnects from client.
 
         Example
         -------
 
-        >>> client.book_exists(
-            name = "Romance of the Three Kingdoms"
-        )
-        True
+            >>> client.disconnect()
+        """
+        self.unwatch_meta()
+        if type(self._client) == pymongo.MongoClient:
+            self._client.close()
+
+    # BULK #
+
+    def _insert_batches(self, collection, records, prepare, batch_size=1000, inserted=None):
+        """
+        Insert records into a collection in unordered batches.
+
+        Notes
+        -----
+        ObjectIds are generated before sending, so they can be returned in the same order as the records even though the batches are unordered. A record that already carries an ObjectId under _id, such as one from a mongodump file, keeps it. Records are read from the iterable one batch at a time.
 
         Parameters
         ----------
-        name : str
-            Name of the book
+        collection : pymongo.Collection
+            Collection to insert into
 
-        within : bool
-            Whether to search exact name or as regular expression
+        records : iterable of dict
+            Raw records
 
-        insensitive : bool
-            Case insensitivity
+        prepare : callable
+            Turns a raw record into a document. KeyError, TypeError and ValueError raised by it are reported as errors for that record
+
+        batch_size : int
+            Number of documents sent per insert_many
+
+        inserted : None or callable
+            Called with every document that was inserted, after its batch is sent
 
         Raises
         ------
-        AttributiveError
-            If book collection not connected yet
-
-        TypeError
-            If name is not a string or capital is not a boolean
+        ValueError
+            If batch_size is smaller than 1
 
         Returns
         -------
-        book_ids : list of bson.objectid.ObjectId
-            ObjectIds of books with the requested name
+        ids : list of None or bson.objectid.ObjectId
+            ObjectId of each record in input order. None if the record was not inserted
+
+        errors : list of dict
+            index : int
+                Position of the record in the input
+            error : str
+                Why the record was not inserted
         """
-        if type(name) != str:
-            raise TypeError(f"name is not a string: {name}")
-        term = name
-        query = {"name": {"$regex": None, "$options": ""}}
-        if exact:
-            term = "^" + name
-        query["name"]["$regex"] = term
-        if insensitive:
-            query["name"]["$options"] += "i"
-        books = list(self._books.find(query))
-        book_ids = [x["_id"] for x in books]
-        return book_ids
-
-    def book_exists(self, objectid):
+        if type(batch_size) != int or batch_size < 1:
+            raise ValueError(f"batch_size is not a positive integer: {batch_size}")
+        ids = []
+        errors = []
+        batch = []
+        positions = []
+
+        def flush():
+            if batch == []:
+                return
+            failed = set()
+            try:
+                collection.insert_many(batch, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                for error in e.details["writeErrors"]:
+                    failed.add(error["index"])
+                    index = positions[error["index"]]
+                    ids[index] = None
+                    errors.append({"index": index, "error": error["errmsg"]})
+            if inserted != None:
+                for position, document in enumerate(batch):
+                    if position not in failed:
+                        inserted(document)
+            batch.clear()
+            positions.clear()
+
+        for index, record in enumerate(records):
+            try:
+                document = prepare(record)
+            except (KeyError, TypeError, ValueError) as e:
+                ids.append(None)
+                errors.append({"index": index, "error": str(e)})
+                continue
+            if type(record.get("_id")) == bson.objectid.ObjectId:
+                document["_id"] = record["_id"]
+            else:
+                document["_id"] = bson.objectid.ObjectId()
+            ids.append(document["_id"])
+            batch.append(document)
+            positions.append(index)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        errors.sort(key=lambda error: error["index"])
+        return ids, errors
+
+    def _read_records(self, filepath):
         """
-        Check if book exists with ObjectId.
-
-        Example
-        -------
-
-            >>> client.book_exists(
-                bson.objectid.ObjectId(
-                    "5f019ed2ffd6b60fae41212f"
-                )
-            )
+        Open a JSON, JSON Lines or BSON file and read the records in it one at a time.
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId or None
-            Book objectid
+        filepath : str or pathlib.Path
+            File path in string or pathlib.Path form
 
         Raises
         ------
+        FileNotFoundError
+            File with the requested name through the requested path not found
+
         TypeError
-            If objectid is not a BSON ObjectId
+            If filepath is not a string or pathlib.Path
+
+        ValueError
+            If file is not a JSON, JSON Lines or BSON file
 
         Returns
         -------
-        exists : bool
-            Whether book exists
+        records : iterator of dict
         """
-        if objectid == [] or objectid == None:
-            return False
-        if type(objectid) != bson.objectid.ObjectId:
-            raise TypeError("objectid is not a BSON ObjectId")
-        book = self._books.find_one(
-            {"_id": objectid}
-        )
-        return book != None
+        if type(filepath) == str:
+            suffix = pathlib.Path(filepath).suffix
+        elif isinstance(filepath, pathlib.Path):
+            suffix = filepath.suffix
+        else:
+            raise TypeError("filepath is not a string or pathlib.Path")
+        if suffix == ".json":
+            return self._iter_json_array(open(filepath, "r"))
+        elif suffix in [".jsonl", ".ndjson"]:
+            return self._iter_json_lines(open(filepath, "r"))
+        elif suffix == ".bson":
+            return self._iter_bson(open(filepath, "rb"))
+        else:
+            raise ValueError("file is not a JSON, JSON Lines or BSON file")
 
-    def book_borrowed(self, book):
+    def _iter_json_array(self, file, chunk_size=65536):
         """
-        Check whether a book is borrowed
-
-        Example
-        -------
+        Decode the items of a top-level JSON array one at a time.
 
-            >>> client.book_borrowed(ObjectId("5f093da5a893e6381d402bb4"))
-            True
+        Notes
+        -----
+        The file is read chunk_size characters at a time and only the unread part of the current chunk is kept, so memory use is bounded by the largest single item rather than the file.
 
         Parameters
         ----------
-        book : bson.objectid.ObjectId
-            BSON ObjectId of Book
+        file : file object
+            Text file opened for reading. Closed once exhausted
+
+        chunk_size : int
+            Number of characters read at a time
 
         Raises
         ------
-        TypeError
-            If book is not a BSON ObjectId
-        """
-        if type(book) != bson.objectid.ObjectId:
-            raise TypeError(f"book is not a BSON ObjectId: {book}")
-        loans = list(self._loans.find({"book": book, "returned": False}))
-        return loans != []
+        ValueError
+            If the file does not hold a JSON array or is malformed
 
-    def add_book(self, name, **kwargs):
+        Yields
+        ------
+        item : dict
         """
-        Add a book into collection.
+        decoder = json.JSONDecoder(object_hook=bson.json_util.object_hook)
+        whitespace = " \t\r\n"
+        with file:
+            buffer = ""
+            position = 0
+            eof = False
+            state = "start"
+            while True:
+                while position < len(buffer) and buffer[position] in whitespace:
+                    position += 1
+                if position == len(buffer) and not eof:
+                    chunk = file.read(chunk_size)
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    eof = chunk == ""
+                    continue
+                if position == len(buffer):
+                    if state == "done":
+                        return
+                    raise ValueError("JSON file ended before the array was closed")
+                char = buffer[position]
+                if state == "done":
+                    raise ValueError("JSON file has data after the array")
+                if state == "start":
+                    if char != "[":
+                        raise ValueError("JSON file does not hold an array")
+                    position += 1
+                    state = "first"
+                    continue
+                if state in ["first", "separator"] and char == "]":
+                    position += 1
+                    state = "done"
+                    continue
+                if state == "separator":
+                    if char != ",":
+                        raise ValueError(f"expected ',' in JSON array, found {char}")
+                    position += 1
+                    state = "value"
+                    continue
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError as e:
+                    if eof:
+                        raise ValueError(f"malformed JSON file: {e}")
+                    end = len(buffer)
+                following = end
+                while following < len(buffer) and buffer[following] in whitespace:
+                    following += 1
+                if (not eof and
+                    (following == len(buffer) or buffer[following] not in ",]")):
+                    # The item may continue in the next chunk
+                    chunk = file.read(chunk_size)
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    eof = chunk == ""
+                    continue
+                position = end
+                state = "separator"
+                yield item
+
+    def _iter_bson(self, file):
+        """
+        Decode a file of concatenated BSON documents, as written by mongodump, one document at a time.
 
         Notes
+        -----
+        The file is memory-mapped and handed to bson.decode_iter, so the operating system pages it in as documents are decoded instead of the whole file being read into memory.
 
-        Example
-        -------
+        Parameters
+        ----------
+        file : file object
+            Binary file opened for reading. Closed once exhausted
 
-            >>> id = client.add_book(
-                name = "Trump: The Art of the Deal",
-                authors = [
-                    "Donald John Trump",
-                    "Tony Schwartz"
-                ],
-                isbn = "0-394-55528-7",
-                genres = [
-                    "Business"
-                ]
-                pages = 372
-                words = 86855
-                pub_date = {
-                    "year": 1987,
-                    "month": 11,
-                    "day": 1
-                },
-                publisher = "Random House"
-            )
-            >>> print(id)
-            ObjectId('...')
+        Raises
+        ------
+        ValueError
+            If the file is not valid BSON
+
+        Yields
+        ------
+        document : dict
+        """
+        with file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                try:
+                    yield from bson.decode_iter(view)
+                except (bson.errors.InvalidBSON, struct.error) as e:
+                    # struct.error comes from trailing bytes too short to hold a document length
+                    raise ValueError(f"malformed BSON file: {e}")
+
+    def _iter_json_lines(self, file):
+        """
+        Decode a JSON Lines file one line at a time.
+
+        Parameters
+        ----------
+        file : file object
+            Text file opened for reading. Closed once exhausted
+
+        Raises
+        ------
+        ValueError
+            If a line is not valid JSON
+
+        Yields
+        ------
+        item : dict
+        """
+        with file:
+            for number, line in enumerate(file, 1):
+                if line.strip() == "":
+                    continue
+                try:
+                    yield bson.json_util.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"malformed JSON on line {number}: {e}")
+
+    def _export(self, collection, name, filepath, format, compression, batch_size, query, fields):
+        """
+        Stream the documents of a collection into a file.
+
+        Notes
+        -----
+        Documents are read from a server-side cursor batch_size at a time and written out as they arrive, so memory use stays the same however large the collection is. BSON exports pass the raw documents from the server straight to the file without decoding them.
 
         Parameters
         ----------
+        collection : pymongo.Collection
+            Collection to export
+
         name : str
-            Name of the book
+            Key of the collection in librarium.CSV_FIELDS
 
-        **kwargs : dict
-            authors : str or list of str
-                Author name or list of authors' names
-            genres : str or list of str
-                Genre of the book
-            isbn : str
-                International standard book number of the book
-            pages : int
-                Number of pages
-            words : int
-                Number of words
-            pub_date : datetime.datetime or dict of int
-                Date of the book's writing or dictionary of year, month and day
-            publisher : str or list of str
-                Name or names of publishers
+        filepath, format, compression, batch_size, query, fields
+            Same as librarium.Library.export_books
 
         Raises
         ------
-        AttributeError
-            If book collection not connected to yet
-
-        KeyError
-            If mandatory keys are missing
+        ImportError
+            If zstd compression is requested but zstandard is not installed
 
         TypeError
-            If any of the parameters given are not correct in their data type or name is missing
+            If filepath is not a string or pathlib.Path
 
         ValueError
-            If erroneous date inputted
+            If the format or compression is unknown or cannot be worked out from filepath
 
         Returns
         -------
-        book.inserted_id : bson.objectid.ObjectId
-            ObjectId of the book added to the collection
+        count : int
+            Number of documents written
         """
-        kwkeys = list(kwargs.keys()) # Return list to reduce processing time
-        document = {
-            "name": None,
-            "authors": [],
-            "isbn": None,
-            "genres": [],
-            "pages": None,
-            "words": None,
-            "pub_date": None,
-            "publisher": []
-        }
-        if type(name) != str:
-            raise TypeError(f"name is not a string: {name}")
-        document["name"] = name
-        list_of_str = ["authors", "genres", "publisher"]
-        for item in list_of_str:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            if type(kwargs[item]) == list:
-                for entity in kwargs[item]:
-                    document[item].append(
-                        str(entity)
-                    )
+        if type(filepath) == str:
+            path = pathlib.Path(filepath)
+        elif isinstance(filepath, pathlib.Path):
+            path = filepath
+        else:
+            raise TypeError("filepath is not a string or pathlib.Path")
+        suffixes = path.suffixes
+        if compression == None:
+            if suffixes != [] and suffixes[-1] in [".gz", ".zst"]:
+                compression = {".gz": "gzip", ".zst": "zstd"}[suffixes[-1]]
             else:
-                document[item].append(
-                    str(kwargs[item])
+                compression = "none"
+        if suffixes != [] and suffixes[-1] in [".gz", ".zst"]:
+            suffixes = suffixes[:-1]
+        if format == None:
+            formats = {
+                ".jsonl": "jsonl",
+                ".ndjson": "jsonl",
+                ".bson": "bson",
+                ".csv": "csv"
+            }
+            if suffixes == [] or suffixes[-1] not in formats:
+                raise ValueError(f"cannot tell export format of {path}")
+            format = formats[suffixes[-1]]
+        if format not in ["jsonl", "bson", "csv"]:
+            raise ValueError(f"format is not 'jsonl', 'bson' or 'csv': {format}")
+        if compression not in ["none", "gzip", "zstd"]:
+            raise ValueError(
+                f"compression is not 'none', 'gzip' or 'zstd': {compression}"
+            )
+        if compression == "zstd" and zstandard == None:
+            raise ImportError("zstd compression requires zstandard")
+        if format == "csv" and fields == None:
+            fields = CSV_FIELDS[name]
+        projection = None
+        if fields != None:
+            projection = {field: 1 for field in fields}
+            if "_id" not in fields:
+                projection["_id"] = 0
+        if format == "bson":
+            # Raw documents are written back out without being decoded
+            collection = collection.with_options(
+                codec_options = bson.codec_options.CodecOptions(
+                    document_class = bson.raw_bson.RawBSONDocument
                 )
-        string = ["isbn"]
-        for item in string:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            document[item] = str(kwargs[item])
-        integer = ["pages", "words"]
-        for item in integer:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            document[item] = int(kwargs[item])
-        date_and_time = ["pub_date"]
-        for item in date_and_time:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            if type(kwargs[item]) == datetime.datetime:
-                document[item] = kwargs[item]
-            elif type(kwargs[item]) == dict:
-                document[item] = datetime.datetime(
-                    year = kwargs[item]["year"],
-                    month = kwargs[item]["month"],
-                    day = kwargs[item]["day"]
+            )
+        cursor = collection.find(query or {}, projection, batch_size=batch_size)
+        count = 0
+        raw = open(path, "wb")
+        try:
+            if compression == "gzip":
+                stream = gzip.GzipFile(fileobj=raw, mode="wb")
+            elif compression == "zstd":
+                stream = zstandard.ZstdCompressor().stream_writer(raw)
+            else:
+                stream = raw
+            if format == "bson":
+                for document in cursor:
+                    stream.write(document.raw)
+                    count += 1
+                stream.close()
+                return count
+            text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+            if format == "jsonl":
+                for document in cursor:
+                    text.write(
+                        bson.json_util.dumps(
+                            document,
+                            json_options = bson.json_util.RELAXED_JSON_OPTIONS
+                        )
+                    )
+                    text.write("\n")
+                    count += 1
+            else:
+                writer = csv.writer(text)
+                writer.writerow(fields)
+                for document in cursor:
+                    row = []
+                    for field in fields:
+                        value = document.get(field)
+                        if value == None:
+                            value = ""
+                        elif type(value) == list:
+                            value = ";".join(str(x) for x in value)
+                        elif type(value) == datetime.datetime:
+                            value = value.isoformat()
+                        row.append(value)
+                    writer.writerow(row)
+                    count += 1
+            text.close()
+            return count
+        finally:
+            cursor.close()
+            raw.close()
+
+    # QUERIES #
+
+    def _match_term(self, field, term, match="contains", insensitive=True):
+        """
+        Compile one string term into a MongoDB condition.
+
+        Notes
+        -----
+        The term is always escaped, so characters such as ( or .* are matched literally instead of changing the query. "prefix" and "exact" terms are anchored at the start, which lets MongoDB walk an index on field when the match is case sensitive.
+
+        Parameters
+        ----------
+        field : str
+            Field the term is matched against
+
+        term : str
+            Literal text to match
+
+        match : "contains", "prefix" or "exact"
+            Whether the term may appear anywhere in the field, must start it or must be all of it
+
+        insensitive : bool
+            Case insensitivity
+
+        Raises
+        ------
+        ValueError
+            If match is not one of the accepted modes
+
+        Returns
+        -------
+        condition : dict
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(
+                f"match is not 'contains', 'prefix' or 'exact': {match}"
+            )
+        if match == "exact" and not insensitive:
+            return {field: term}
+        pattern = re.escape(term)
+        if match != "contains":
+            pattern = "^" + pattern
+        if match == "exact":
+            pattern += "$"
+        return {field: {"$regex": pattern, "$options": "i" if insensitive else ""}}
+
+    def _cached_query(self, key, compile):
+        """
+        Get a compiled query, compiling it only the first time its key is seen.
+
+        Notes
+        -----
+        Up to librarium.QUERY_CACHE_SIZE queries are kept, dropping the least recently used. A copy is returned so callers may extend it freely.
+
+        Parameters
+        ----------
+        key : tuple
+            Everything the query depends on
+
+        compile : callable
+            Builds the query when it is not cached
+
+        Returns
+        -------
+        query : dict
+        """
+        key = repr(key)
+        query = self._queries.get(key)
+        if query == None:
+            query = compile()
+            self._queries[key] = query
+            if len(self._queries) > QUERY_CACHE_SIZE:
+                self._queries.popitem(last=False)
+        else:
+            self._queries.move_to_end(key)
+        return copy.deepcopy(query)
+
+    # CACHE #
+
+    def enable_cache(self, size=1024, ttl=60):
+        """
+        Cache the results of get_book and get_borrower.
+
+        Notes
+        -----
+        Results are kept per ObjectId and per combination of fields and loans. The least recently used result is dropped once size results are cached, and a result older than ttl seconds is fetched again. Writes made through this Library (update_book, delete_book, update_borrower, delete_borrower, add_borrowers with update, add_loan and return_loan) drop the results they affect at once, while writes from other clients are only seen once ttl runs out. Enabling the cache again empties it.
+
+        Example
+        -------
+
+            >>> client.enable_cache(size = 256, ttl = 30)
+            >>> client.get_book(book_id)
+            >>> client.get_book(book_id)
+            >>> client.cache_stats()["hits"]
+            1
+
+        Parameters
+        ----------
+        size : int
+            Maximum number of cached results
+
+        ttl : int or float
+            Seconds a cached result stays valid
+
+        Raises
+        ------
+        ValueError
+            If size is not a positive integer or ttl is not a positive number
+
+        Returns
+        -------
+        self : librarium.Library
+        """
+        if type(size) != int or size < 1:
+            raise ValueError(f"size is not a positive integer: {size}")
+        if type(ttl) not in [int, float] or ttl <= 0:
+            raise ValueError(f"ttl is not a positive number: {ttl}")
+        self._cache = collections.OrderedDict()
+        self._cache_keys = {}
+        self._cache_size = size
+        self._cache_ttl = ttl
+        self._cache_stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0
+        }
+        return self
+
+    def disable_cache(self):
+        """
+        Stop caching and drop every cached result.
+
+        Returns
+        -------
+        self : librarium.Library
+        """
+        self._cache = None
+        self._cache_keys = {}
+        return self
+
+    def clear_cache(self):
+        """
+        Drop every cached result, keeping the cache enabled and its statistics.
+
+        Returns
+        -------
+        self : librarium.Library
+        """
+        if self._cache != None:
+            self._cache.clear()
+            self._cache_keys = {}
+        return self
+
+    def cache_stats(self):
+        """
+        Get statistics about the cache.
+
+        Example
+        -------
+
+            >>> client.cache_stats()
+            {'hits': 12, 'misses': 4, 'evictions': 0, 'invalidations': 1, 'size': 3, 'capacity': 1024, 'hit_rate': 0.75}
+
+        Returns
+        -------
+        stats : None or dict
+            hits, misses, evictions and invalidations since the cache was enabled, the number of cached results (size), the maximum (capacity) and the fraction of lookups that were hits (hit_rate). None if caching is disabled
+        """
+        if self._cache == None:
+            return None
+        stats = dict(self._cache_stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["size"] = len(self._cache)
+        stats["capacity"] = self._cache_size
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _cache_get(self, key):
+        """
+        Look up a cached result.
+
+        Parameters
+        ----------
+        key : tuple
+            Kind of document, its ObjectId, then whatever else the result depends on
+
+        Returns
+        -------
+        hit : bool
+            Whether a valid result was cached
+
+        value : None or dict
+            Copy of the cached result
+        """
+        if self._cache == None:
+            return False, None
+        entry = self._cache.get(key)
+        if entry != None and time.monotonic() >= entry[0]:
+            self._cache_drop(key)
+            entry = None
+        if entry == None:
+            self._cache_stats["misses"] += 1
+            return False, None
+        self._cache.move_to_end(key)
+        self._cache_stats["hits"] += 1
+        return True, copy.deepcopy(entry[1])
+
+    def _cache_put(self, key, value):
+        """
+        Cache a result, evicting the least recently used results beyond the size limit.
+
+        Parameters
+        ----------
+        key : tuple
+            Same as librarium.Library._cache_get
+
+        value : None or dict
+            Result to cache. A copy is kept
+        """
+        if self._cache == None:
+            return
+        self._cache[key] = (time.monotonic() + self._cache_ttl, copy.deepcopy(value))
+        self._cache.move_to_end(key)
+        self._cache_keys.setdefault(key[:2], set()).add(key)
+        while len(self._cache) > self._cache_size:
+            oldest = next(iter(self._cache))
+            self._cache_drop(oldest)
+            self._cache_stats["evictions"] += 1
+
+    def _cache_drop(self, key):
+        """
+        Remove a single cached result.
+
+        Parameters
+        ----------
+        key : tuple
+            Same as librarium.Library._cache_get
+        """
+        self._cache.pop(key, None)
+        keys = self._cache_keys.get(key[:2])
+        if keys != None:
+            keys.discard(key)
+            if keys == set():
+                del self._cache_keys[key[:2]]
+
+    def _invalidate(self, kind, *objectids):
+        """
+        Drop every cached result of some books or borrowers.
+
+        Parameters
+        ----------
+        kind : "book" or "borrower"
+            Kind of document
+
+        *objectids : bson.objectid.ObjectId
+            ObjectIds of the documents that changed
+        """
+        if self._cache == None:
+            return
+        for objectid in objectids:
+            keys = self._cache_keys.pop((kind, objectid), set())
+            for key in keys:
+                self._cache.pop(key, None)
+            self._cache_stats["invalidations"] += len(keys)
+
+    # PAGINATION #
+
+    def _projection(self, fields):
+        """
+        Turn a list of wanted fields into a MongoDB projection.
+
+        Parameters
+        ----------
+        fields : None or list of str
+            Fields wanted by the caller. Every field if None
+
+        Raises
+        ------
+        TypeError
+            If fields is not a list of strings
+
+        Returns
+        -------
+        projection : None or dict
+        """
+        if fields == None:
+            return None
+        if type(fields) != list or any(type(x) != str for x in fields):
+            raise TypeError(f"fields is not a list of strings: {fields}")
+        projection = {field: 1 for field in fields}
+        if projection == {}:
+            projection = {"_id": 1}
+        return projection
+
+    def _keyset(self, query, after, limit, key, direction):
+        """
+        Narrow a query to the documents after a keyset pagination position.
+
+        Notes
+        -----
+        Documents whose key is null or missing come first in ascending order and last in descending order, as MongoDB sorts them.
+
+        Parameters
+        ----------
+        query : dict
+            MongoDB query of the search
+
+        after, limit, key, direction
+            Same as librarium.Library.page_books
+
+        Raises
+        ------
+        TypeError
+            If after does not match key
+
+        ValueError
+            If limit is smaller than 1 or direction is not 1 or -1
+
+        Returns
+        -------
+        query : dict
+            Query matching only documents after the position
+
+        sort : list of tuple of str, int
+            Sort order matching the pagination
+        """
+        if type(limit) != int or limit < 1:
+            raise ValueError(f"limit is not a positive integer: {limit}")
+        if direction not in [1, -1]:
+            raise ValueError(f"direction is not 1 or -1: {direction}")
+        if key == "_id":
+            sort = [("_id", direction)]
+        else:
+            sort = [(key, direction), ("_id", direction)]
+        if after == None:
+            return query, sort
+        compare = "$gt" if direction == 1 else "$lt"
+        if key == "_id":
+            condition = {"_id": {compare: after}}
+        else:
+            if type(after) != tuple or len(after) != 2:
+                raise TypeError(
+                    f"after is not a tuple of {key} and ObjectId: {after}"
+                )
+            value, objectid = after
+            # Null and missing values sort before every other value, but $gt and $lt never match across types
+            if value == None and direction == 1:
+                condition = {
+                    "$or": [
+                        {key: None, "_id": {compare: objectid}},
+                        {key: {"$ne": None}}
+                    ]
+                }
+            elif value == None:
+                condition = {key: None, "_id": {compare: objectid}}
+            else:
+                condition = {
+                    "$or": [
+                        {key: {compare: value}},
+                        {key: value, "_id": {compare: objectid}}
+                    ]
+                }
+                if direction == -1:
+                    condition["$or"].append({key: None})
+        if query == {}:
+            return condition, sort
+        return {"$and": [query, condition]}, sort
+
+    def _next_after(self, documents, limit, key):
+        """
+        Get the position to resume keyset pagination from.
+
+        Parameters
+        ----------
+        documents : list of dict
+            Documents of the current page
+
+        limit, key
+            Same as librarium.Library.page_books
+
+        Returns
+        -------
+        after : None, bson.objectid.ObjectId or tuple
+            None if the page is short of limit
+        """
+        if len(documents) < limit:
+            return None
+        last = documents[-1]
+        if key == "_id":
+            return last["_id"]
+        return (last.get(key), last["_id"])
+
+    # BOOKS #
+
+    def get_book(self, objectid, fields=None):
+        """
+        Get details of book with just objectid
+
+        Notes
+        -----
+        Served from the cache if enabled with librarium.Library.enable_cache.
+
+        Example
+        -------
+
+            >>> details = client.get_book(
+                bson.objectid.ObjectId("507f191e810c19729de860ea"),
+                fields = ["name", "borrowed"]
+            )
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            BSON ObjectId of book
+
+        fields : None or list of str
+            Fields to fetch, _id always included. Every field if None. "borrowed" and "available" are computed from "available_copies"
+
+        Raises
+        ------
+        TypeError
+            If objectid is not a BSON ObjectId or fields is not a list of strings
+
+        Returns
+        -------
+        details : None or dict
+            Details of the book. None if book not found
+        """
+        if type(objectid) != bson.objectid.ObjectId:
+            raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
+        key = ("book", objectid, repr(fields))
+        hit, details = self._cache_get(key)
+        if hit:
+            return details
+        books = list(
+            self._books.aggregate(
+                self._book_pipeline({"_id": objectid}, fields=fields)
+            )
+        )
+        details = books[0] if books != [] else None
+        self._cache_put(key, details)
+        return details
+
+    def find_books(self, name, exact=True, insensitive=False, limit=0):
+        """
+        Find book(s) with name.
+
+        Notes
+        -----
+        An exact lookup is a plain equality, served by the librarium_name index or, if insensitive, by the case-insensitive librarium_name_ci index.
+
+        Example
+        -------
+
+        >>> client.book_exists(
+            name = "Romance of the Three Kingdoms"
+        )
+        True
+
+        Parameters
+        ----------
+        name : str
+            Name of the book
+
+        exact : bool
+            Whether name must be the book's whole name or may appear anywhere in it. name is matched literally either way
+
+        insensitive : bool
+            Case insensitivity
+
+        limit : int
+            Maximum number of ObjectIds to return. No limit if 0
+
+        Raises
+        ------
+        AttributiveError
+            If book collection not connected yet
+
+        TypeError
+            If name is not a string or capital is not a boolean
+
+        Returns
+        -------
+        book_ids : list of bson.objectid.ObjectId
+            ObjectIds of books with the requested name
+        """
+        if type(name) != str:
+            raise TypeError(f"name is not a string: {name}")
+        if exact:
+            books = self._books.find(
+                {"name": name},
+                {"_id": 1},
+                collation = CASE_INSENSITIVE if insensitive else None
+            ).limit(limit)
+        else:
+            books = self._books.find(
+                self._match_term("name", name, "contains", insensitive),
+                {"_id": 1}
+            ).limit(limit)
+        book_ids = [x["_id"] for x in books]
+        return book_ids
+
+    def book_exists(self, objectid):
+        """
+        Check if book exists with ObjectId.
+
+        Example
+        -------
+
+            >>> client.book_exists(
+                bson.objectid.ObjectId(
+                    "5f019ed2ffd6b60fae41212f"
+                )
+            )
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId or None
+            Book objectid
+
+        Raises
+        ------
+        TypeError
+            If objectid is not a BSON ObjectId
+
+        Returns
+        -------
+        exists : bool
+            Whether book exists
+        """
+        if objectid == [] or objectid == None:
+            return False
+        if type(objectid) != bson.objectid.ObjectId:
+            raise TypeError("objectid is not a BSON ObjectId")
+        book = self._books.find_one(
+            {"_id": objectid},
+            {"_id": 1}
+        )
+        return book != None
+
+    def book_borrowed(self, book):
+        """
+        Check whether a book is borrowed
+
+        Notes
+        -----
+        Reads the available_copies count kept on the book by librarium.Library.add_loan and librarium.Library.return_loan, so the loans collection is not queried.
+
+        Example
+        -------
+
+            >>> client.book_borrowed(ObjectId("5f093da5a893e6381d402bb4"))
+            True
+
+        Parameters
+        ----------
+        book : bson.objectid.ObjectId
+            BSON ObjectId of Book
+
+        Raises
+        ------
+        TypeError
+            If book is not a BSON ObjectId
+        """
+        if type(book) != bson.objectid.ObjectId:
+            raise TypeError(f"book is not a BSON ObjectId: {book}")
+        details = self._books.find_one({"_id": book}, {"available_copies": 1})
+        return details != None and details.get("available_copies") == 0
+
+    def _book_pipeline(self, query, sort=[], limit=0, fields=None):
+        """
+        Build an aggregation pipeline that finds books and flags whether each one is borrowed.
+
+        Notes
+        -----
+        The borrowed and available flags are derived from the available_copies count kept on each book by librarium.Library.add_loan and librarium.Library.return_loan, so only the books collection is read. Queries using $text get a relevance score field and are sorted by it before any other sort keys.
+
+        Parameters
+        ----------
+        query : dict
+            MongoDB query used to match books
+
+        sort : list of tuple of str, int
+            How to sort matched books
+
+        limit : int
+            Maximum number of books to return. No limit if 0
+
+        fields : None or list of str
+            Fields to return. Every field if None. The borrowed flag is only computed if "borrowed" is wanted
+
+        Returns
+        -------
+        pipeline : list of dict
+        """
+        pipeline = [{"$match": query}]
+        if "$text" in query:
+            pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+            sort = [("score", {"$meta": "textScore"})] + sort
+            if fields != None and "score" not in fields:
+                fields = fields + ["score"]
+        if sort != []:
+            pipeline.append({"$sort": bson.son.SON(sort)})
+        if limit != 0:
+            pipeline.append({"$limit": limit})
+        computed = {}
+        if fields == None or "borrowed" in fields:
+            computed["borrowed"] = {"$eq": ["$available_copies", 0]}
+        if fields == None or "available" in fields:
+            computed["available"] = {"$ne": ["$available_copies", 0]}
+        if computed != {}:
+            pipeline.append({"$addFields": computed})
+        if fields != None:
+            pipeline.append({"$project": self._projection(fields)})
+        return pipeline
+
+    def add_book(self, name, **kwargs):
+        """
+        Add a book into collection.
+
+        Notes
+
+        Example
+        -------
+
+            >>> id = client.add_book(
+                name = "Trump: The Art of the Deal",
+                authors = [
+                    "Donald John Trump",
+                    "Tony Schwartz"
+                ],
+                isbn = "0-394-55528-7",
+                genres = [
+                    "Business"
+                ]
+                pages = 372
+                words = 86855
+                pub_date = {
+                    "year": 1987,
+                    "month": 11,
+                    "day": 1
+                },
+                publisher = "Random House"
+            )
+            >>> print(id)
+            ObjectId('...')
+
+        Parameters
+        ----------
+        name : str
+            Name of the book
+
+        **kwargs : dict
+            authors : str or list of str
+                Author name or list of authors' names
+            genres : str or list of str
+                Genre of the book
+            isbn : str
+                International standard book number of the book
+            pages : int
+                Number of pages
+            words : int
+                Number of words
+            pub_date : datetime.datetime or dict of int
+                Date of the book's writing or dictionary of year, month and day
+            publisher : str or list of str
+                Name or names of publishers
+            copies : int
+                Number of physical copies that can be lent out at once. 1 if not given
+
+        Raises
+        ------
+        AttributeError
+            If book collection not connected to yet
+
+        KeyError
+            If mandatory keys are missing
+
+        TypeError
+            If any of the parameters given are not correct in their data type or name is missing
+
+        ValueError
+            If erroneous date inputted or copies is smaller than 1
+
+        Returns
+        -------
+        book.inserted_id : bson.objectid.ObjectId
+            ObjectId of the book added to the collection
+        """
+        document = self._book_document(name, **kwargs)
+        book = self._books.insert_one(document)
+        if self._index != None:
+            self._index.add(document)
+        return book.inserted_id
+
+    def _book_document(self, name, **kwargs):
+        """
+        Build a book document following the rules of librarium.Library.add_book.
+
+        Parameters
+        ----------
+        name : str
+            Name of the book
+
+        **kwargs : dict
+            Same as librarium.Library.add_book
+
+        Raises
+        ------
+        KeyError
+            If mandatory keys are missing
+
+        TypeError
+            If any of the parameters given are not correct in their data type or name is missing
+
+        ValueError
+            If erroneous date inputted
+
+        Returns
+        -------
+        document : dict
+            Book document ready to be inserted
+        """
+        kwkeys = list(kwargs.keys()) # Return list to reduce processing time
+        document = {
+            "name": None,
+            "authors": [],
+            "isbn": None,
+            "genres": [],
+            "pages": None,
+            "words": None,
+            "pub_date": None,
+            "publisher": [],
+            "copies": 1,
+            "available_copies": 1,
+            "current_loans": []
+        }
+        if type(name) != str:
+            raise TypeError(f"name is not a string: {name}")
+        document["name"] = name
+        list_of_str = ["authors", "genres", "publisher"]
+        for item in list_of_str:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            if type(kwargs[item]) == list:
+                for entity in kwargs[item]:
+                    document[item].append(
+                        str(entity)
+                    )
+            else:
+                document[item].append(
+                    str(kwargs[item])
+                )
+        string = ["isbn"]
+        for item in string:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            document[item] = str(kwargs[item])
+        integer = ["pages", "words"]
+        for item in integer:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            document[item] = int(kwargs[item])
+        if "copies" in kwkeys and kwargs["copies"] != None:
+            document["copies"] = self._copies(kwargs["copies"])
+            document["available_copies"] = document["copies"]
+        date_and_time = ["pub_date"]
+        for item in date_and_time:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            if type(kwargs[item]) == datetime.datetime:
+                document[item] = kwargs[item]
+            elif type(kwargs[item]) == dict:
+                document[item] = datetime.datetime(
+                    year = kwargs[item]["year"],
+                    month = kwargs[item]["month"],
+                    day = kwargs[item]["day"]
+                )
+            else:
+                raise TypeError(
+                    f"{item} is not datetime.datetime or dictionary"
+                )
+        document["last_updated"] = datetime.datetime.utcnow()
+        return document
+
+    def _copies(self, copies):
+        """
+        Check a number of copies of a book.
+
+        Parameters
+        ----------
+        copies : int
+            Number of physical copies
+
+        Raises
+        ------
+        TypeError
+            If copies is not an integer
+
+        ValueError
+            If copies is smaller than 1
+
+        Returns
+        -------
+        copies : int
+        """
+        if type(copies) != int:
+            raise TypeError(f"copies is not an integer: {copies}")
+        if copies < 1:
+            raise ValueError(f"copies is smaller than 1: {copies}")
+        return copies
+
+    def update_book(self, objectid, **kwargs):
+        """
+        Update a book in the collection
+
+        Example
+        -------
+
+            >>> id = client.add_book(
+                name = "Trump: The Art of the Deal",
+                authors = [
+                    "Donald John Trump",
+                    "Tony Schwartz"
+                ],
+                isbn = "0-394-55528-7",
+                genres = [
+                    "Business"
+                ]
+                pages = 372
+                words = 86855
+                pub_date = {
+                    "year": 1969, # Erroneous data
+                    "month": 11,
+                    "day": 1
+                },
+                publisher = "Random House"
+            )
+            >>> client.update_book(
+                objectid = id
+                pub_date = {
+                    "year": 1987,
+                    "month": 11,
+                    "day": 1
+                }
+            )
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            ObjectId of wanted book
+
+        **kwargs : dict
+            name : str
+                Name of the book
+            authors : str or list of str
+                Author name or list of authors' names
+            isbn : str
+                International standard book number of the book
+            genres : str or list of str
+                Genres of the book
+            pages : int
+                Number of pages
+            words : int
+                Number of words
+            pub_date : datetime.datetime or dict of int
+                Date of the book's writing or dictionary of year, month and day
+            publisher : str or list of str
+                Name or names of publishers
+            copies : int
+                Number of physical copies. Available copies change by the same amount
+
+        Raises
+        ------
+        ValueError
+            If book does not exist, or copies is smaller than 1 or than the number of copies lent out
+        """
+        kwkeys = list(kwargs.keys())
+        if not self.book_exists(objectid):
+            raise ValueError(
+                f"Book with requested ObjectId does not exist: {objectid}"
+            )
+        if "copies" in kwkeys and kwargs["copies"] != None:
+            self._copies(kwargs["copies"])
+        document = {}
+        list_of_str = ["authors", "genres", "publisher"]
+        for item in list_of_str:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            if type(kwargs[item]) == list:
+                for entity in kwargs[item]:
+                    document[item].append(
+                        str(entity)
+                    )
+            else:
+                document[item].append(
+                    str(kwargs[item])
+                )
+        string = ["name", "isbn"]
+        for item in string:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            document[item] = str(kwargs[item])
+        integer = ["pages", "words"]
+        for item in integer:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            document[item] = int(kwargs[item])
+        date_and_time = ["pub_date"]
+        for item in date_and_time:
+            if item not in kwkeys:
+                continue
+            if kwargs[item] == None:
+                continue
+            if type(kwargs[item]) == datetime.datetime:
+                document[item] = kwargs[item]
+            elif type(kwargs[item]) == dict:
+                document[item] = datetime.datetime(
+                    year = kwargs[item]["year"],
+                    month = kwargs[item]["month"],
+                    day = kwargs[item]["day"]
+                )
+            else:
+                raise TypeError(
+                    f"{item} is not datetime.datetime or dictionary"
+                )
+        document["last_updated"] = datetime.datetime.utcnow()
+        self._books.update_one(
+            {"_id": objectid},
+            {"$set": document}
+        )
+        if "copies" in kwkeys and kwargs["copies"] != None:
+            self._set_copies(objectid, kwargs["copies"])
+        self._invalidate("book", objectid)
+        if self._index != None:
+            details = self._books.find_one({"_id": objectid})
+            if details != None:
+                self._index.add(details)
+
+    def _set_copies(self, objectid, copies):
+        """
+        Change the number of copies of a book without disturbing copies lent out meanwhile.
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            BSON ObjectId of book
+
+        copies : int
+            New number of copies
+
+        Raises
+        ------
+        ValueError
+            If more copies than that are lent out
+        """
+        while True:
+            details = self._books.find_one(
+                {"_id": objectid},
+                {"copies": 1, "available_copies": 1}
+            )
+            if details == None:
+                return
+            if "available_copies" not in details:
+                self.repair_availability([objectid])
+                continue
+            change = copies - details["copies"]
+            if details["available_copies"] + change < 0:
+                raise ValueError(
+                    f"copies is smaller than the {details['copies'] - details['available_copies']} copies lent out: {objectid}"
+                )
+            # Only applies if no copy was lent out or returned since reading
+            changed = self._books.update_one(
+                {
+                    "_id": objectid,
+                    "copies": details["copies"],
+                    "available_copies": details["available_copies"]
+                },
+                {
+                    "$set": {"copies": copies},
+                    "$inc": {"available_copies": change}
+                }
+            )
+            if changed.matched_count == 1:
+                return
+
+    def add_books(self, books, bulk=False, batch_size=1000):
+        """
+        Add multiple books to collection.
+
+        Notes
+        -----
+        In bulk mode each book is checked with the same rules as librarium.Library.add_book and sent to MongoDB through unordered insert_many calls of batch_size books each. A book that fails is reported and skipped instead of aborting the rest of the batch.
+
+        Example
+        -------
+
+            >>> books = [
+                {
+                    name = "Trump: The Art of the Deal",
+                    authors = [
+                        "Donald John Trump",
+                        "Tony Schwartz"
+                    ],
+                    isbn = "0-394-55528-7",
+                    genres = [
+                        "Business"
+                    ]
+                    pages = 372
+                    words = 86855
+                    pub_date = {
+                        "year": 1987,
+                        "month": 11,
+                        "day": 1
+                    },
+                    publisher = "Random House"
+                },
+                {
+                    name = "A Pickle for the Knowing Ones",
+                    authors = [
+                        "Timothy Dexter"
+                    ],
+                    isbn = "978-0-344-45584-1",
+                    genres = [
+                        "Politics"
+                    ]
+                    pages = 37
+                    words = None
+                    pub_date = {
+                        "year": 1797,
+                        "month": 1,
+                        "day": 22
+                    },
+                    publisher = "Random House"
+                }
+            ]
+            >>> print(books)
+            [ObjectId('...'),ObjectId('...')]
+
+        Parameters
+        ----------
+        books : iterable of dict of str, int, datetime.datetime, list of str or dict of int
+            List of books with parameters to be inputted into the system. Parameters should match the **kwargs format in librarium.Library.add_books
+
+        bulk : bool
+            Whether to insert the books in batches and report errors per book
+
+        batch_size : int
+            Number of books sent per insert_many in bulk mode
+
+        Raises
+        ------
+        AttributeError
+            If book collection not connected to yet
+
+        KeyError
+            If mandatory keys are missing
+
+        TypeError
+            If any of the parameters given are not correct in their data type or name is missing
+
+        ValueError
+            If erroneous date inputted
+
+        Returns
+        -------
+        book_ids : list of bson.objectid.ObjectId
+            List of ObjectIds of the books added to the library.
+
+        errors : list of dict
+            Only returned in bulk mode. The index and error message of every book not added, whose ObjectId in book_ids is None
+        """
+        if not bulk:
+            return [self.add_book(**book) for book in books]
+        return self._insert_batches(
+            self._books,
+            books,
+            lambda book: self._book_document(**book),
+            batch_size,
+            None if self._index == None else self._index.add
+        )
+
+    def import_books(self, filepath, bulk=False, batch_size=1000):
+        """
+        Import books from a JSON, JSON Lines or BSON file.
+
+        Notes
+        -----
+        The JSON file should have an array as the first-level data. JSON Lines files (.jsonl or .ndjson) hold one book per line. BSON files hold concatenated documents, as written by mongodump. MongoDB extended JSON such as {"$oid": ...} is understood, so files written by librarium.Library.export_books can be imported back, and in bulk mode each document keeps its _id. Books are read from the file one at a time as they are inserted, so the whole file is never held in memory.
+
+        Example
+        -------
+
+            >>> books = client.import_books(
+                filepath = pathlib.Path("books.json")
+            )
+
+        Parameters
+        ----------
+        filepath : str or pathlib.Path
+            File path in string or pathlib.Path form (recommended)
+
+        bulk : bool
+            Whether to insert the books in batches. See librarium.Library.add_books
+
+        batch_size : int
+            Number of books sent per insert_many in bulk mode
+
+        Raises
+        ------
+        FileNotFoundError
+            File with the requested name through the requested path not found
+
+        TypeError
+            If filepath is not a string or pathlib.Path
+
+        ValueError
+            If file is not a JSON, JSON Lines or BSON file
+
+        Returns
+        -------
+        books_id : list of bson.objectid.ObjectId
+
+        errors : list of dict
+            Only returned in bulk mode. See librarium.Library.add_books
+        """
+        data = self._read_records(filepath)
+        return self.add_books(data, bulk=bulk, batch_size=batch_size)
+
+    def export_books(self, filepath, format=None, compression=None, batch_size=1000, query=None, fields=None):
+        """
+        Export books to a JSON Lines, BSON or CSV file.
+
+        Notes
+        -----
+        Streamed to the file by librarium.Library._export, whose notes cover memory use and BSON output.
+
+        Example
+        -------
+
+            >>> count = client.export_books(
+                filepath = pathlib.Path("books.jsonl.gz")
+            )
+
+        Parameters
+        ----------
+        filepath : str or pathlib.Path
+            File path in string or pathlib.Path form (recommended)
+
+        format : None, "jsonl", "bson" or "csv"
+            Format of the file. Worked out from the suffix of filepath (.jsonl, .ndjson, .bson or .csv) if None
+
+        compression : None, "none", "gzip" or "zstd"
+            Compression of the file. Worked out from the suffix of filepath (.gz or .zst) if None. zstd requires the zstandard package
+
+        batch_size : int
+            Number of documents fetched from the server per round trip
+
+        query : None or dict
+            MongoDB query selecting the documents to export. Every document if None
+
+        fields : None or list of str
+            Fields to export. Every field if None, or the columns in librarium.CSV_FIELDS for CSV
+
+        Raises
+        ------
+        ImportError
+            If zstd compression is requested but zstandard is not installed
+
+        TypeError
+            If filepath is not a string or pathlib.Path
+
+        ValueError
+            If the format or compression is unknown or cannot be worked out from filepath
+
+        Returns
+        -------
+        count : int
+            Number of documents written
+        """
+        return self._export(
+            self._books,
+            "books",
+            filepath,
+            format,
+            compression,
+            batch_size,
+            query,
+            fields
+        )
+
+    def search_books(self, sort=[], fields=None, mode="regex", match="contains", **terms):
+        """
+        Search books based on different available queries.
+
+        Notes
+        -----
+        In "regex" mode every term must match its field as chosen by match. Terms are always matched literally. With the default "contains" a term may appear anywhere in its field, ignoring case, which no index can serve, so each search scans the collection. "prefix" and "exact" are case sensitive and anchored, so the name index from librarium.INDEXES is used.
+
+        In "text" mode the name, authors, genres and publisher terms are looked up in the text index from librarium.INDEXES instead. Books matching any of their words are returned with a relevance score under "score", best matches first, and common word endings are ignored. isbn, pages, words and pub_date terms still filter as in "regex" mode.
+
+        In "local" mode the search is answered by the librarium.SearchIndex attached with librarium.Library.attach_index, refreshing it first if it is older than its refresh_interval. Every word of the string terms must match part of a word in its field, or with "exact" each term must be all of its field, ignoring case and punctuation. Books come with a BM25 "score", best matches first unless sort is given, and their copy counts and borrowed flag are read again with one query.
+
+        Example
+        -------
+
+            >>> info = client.search_books(
+                sort = [("isbn",1)],
+                name = ["Trump: The Art of"],
+                authors = ["Donald John", "Timot"],
+                isbn = ["0-394"],
+                genres = ["Business"],
+                pages = [{"$gte": 370, "$lte": 375}]
+                words = [{"$gte": 80000, "$lte": 90000}],
+                pub_date = [
+                    {
+                        "$lte": datetime.datetime(1988,1,1),
+                        "$gte": datetime.datetime(1986,1,1)
+                    }
+                ]
+                publisher = ["Random House"],
+            )
+            >>> print(info)
+            [{data}]
+
+        Parameters
+        ----------
+        sort : list of tuple of str, int
+            How to sort returned items
+
+        fields : None or list of str
+            Fields to return. See librarium.Library.get_book
+
+        mode : "regex", "text" or "local"
+            How string terms are matched
+
+        match : "contains", "prefix" or "exact"
+            Whether each string term may appear anywhere in its field, must start it or must be all of it. In "text" mode only isbn terms follow it
+
+        **terms : dict
+            name : list of str
+            authors : list of str
+            isbn : list of str
+            genres : list of str
+            pages : list of dict of int
+            words : list of dict of int
+            pub_date : list of dict of datetime.datetime
+            publisher : list of str
+            available : bool
+                Only books that are (True) or are not (False) available to borrow
+
+        Raises
+        ------
+        AttributeError
+            If book collection not connected to yet
+
+        KeyError
+            If mandatory keys are missing
+
+        TypeError
+            If any of the parameters given are not correct in their data type or **terms is missing
+
+        ValueError
+            If erroneous date inputted or mode or match is not one of the accepted modes
+
+        Returns
+        -------
+        list of dict
+        """
+        return list(
+            self.iter_books(sort, fields=fields, mode=mode, match=match, **terms)
+        )
+
+    def iter_books(self, sort=[], batch_size=None, fields=None, mode="regex", match="contains", **terms):
+        """
+        Lazily search books based on different available queries.
+
+        Notes
+        -----
+        Books are yielded as the server-side cursor delivers them instead of being collected into a list first.
+
+        Example
+        -------
+
+            >>> for book in client.iter_books(name = ["Trump"]):
+                    print(book["name"])
+
+        Parameters
+        ----------
+        sort : list of tuple of str, int
+            How to sort returned items
+
+        batch_size : None or int
+            Number of books fetched from the server per round trip. Server default if None
+
+        fields : None or list of str
+            Fields to return. See librarium.Library.get_book
+
+        mode : "regex", "text" or "local"
+            How string terms are matched. See librarium.Library.search_books
+
+        match : "contains", "prefix" or "exact"
+            See librarium.Library.search_books
+
+        **terms : dict
+            Same as librarium.Library.search_books
+
+        Yields
+        ------
+        dict
+        """
+        if mode == "local":
+            yield from self._search_local(sort, fields, match, **terms)
+            return
+        query = self._books_query(mode, match, **terms)
+        cursor = self._books.aggregate(
+            self._book_pipeline(query, sort, fields=fields),
+            batchSize = batch_size
+        )
+        with cursor:
+            yield from cursor
+
+    def page_books(self, after=None, limit=20, key="_id", direction=1, fields=None, match="contains", **terms):
+        """
+        Get one page of a book search with keyset pagination.
+
+        Notes
+        -----
+        Instead of skipping over earlier pages, each page resumes right after the last book of the previous one, so every page costs the same however deep it is.
+
+        Example
+        -------
+
+            >>> books, after = client.page_books(limit = 20, name = ["Trump"])
+            >>> while after != None:
+                    books, after = client.page_books(
+                        after = after,
+                        limit = 20,
+                        name = ["Trump"]
+                    )
+
+        Parameters
+        ----------
+        after : None, bson.objectid.ObjectId or tuple
+            Value returned with the previous page, or None for the first page. An ObjectId if key is "_id", otherwise a tuple of the key value and ObjectId of the last book
+
+        limit : int
+            Maximum number of books in the page
+
+        key : str
+            Field to order the pages by. Ties are broken by _id
+
+        direction : int
+            1 for ascending or -1 for descending order
+
+        fields : None or list of str
+            Fields to return. See librarium.Library.get_book. key is always returned
+
+        match : "contains", "prefix" or "exact"
+            See librarium.Library.search_books
+
+        **terms : dict
+            Same as librarium.Library.search_books
+
+        Raises
+        ------
+        TypeError
+            If after does not match key
+
+        ValueError
+            If limit is smaller than 1 or direction is not 1 or -1
+
+        Returns
+        -------
+        books : list of dict
+
+        after : None, bson.objectid.ObjectId or tuple
+            What to pass as after for the next page. None if the page is short of limit, so there are no more pages
+        """
+        query, sort = self._keyset(
+            self._books_query(match=match, **terms), after, limit, key, direction
+        )
+        if fields != None and key not in fields:
+            fields = fields + [key]
+        books = list(
+            self._books.aggregate(self._book_pipeline(query, sort, limit, fields))
+        )
+        return books, self._next_after(books, limit, key)
+
+    def count_books(self, mode="regex", match="contains", **terms):
+        """
+        Count books matching search terms without fetching them.
+
+        Example
+        -------
+
+            >>> client.count_books(
+                authors = ["Donald John"]
+            )
+            3
+
+        Parameters
+        ----------
+        mode : "regex", "text" or "local"
+            How string terms are matched. See librarium.Library.search_books
+
+        match : "contains", "prefix" or "exact"
+            See librarium.Library.search_books
+
+        **terms : dict
+            Same as librarium.Library.search_books
+
+        Returns
+        -------
+        count : int
+        """
+        if mode == "local":
+            return len(self._search_local([], ["_id"], match, **terms))
+        return self._books.count_documents(self._books_query(mode, match, **terms))
+
+    def _search_local(self, sort=[], fields=None, match="contains", **terms):
+        """
+        Answer a book search from the attached librarium.SearchIndex.
+
+        Parameters
+        ----------
+        sort, fields, match, **terms
+            Same as librarium.Library.search_books. "contains" and "prefix" apply to each word of a term, "exact" to the whole field
+
+        Raises
+        ------
+        ValueError
+            If no librarium.SearchIndex is attached, match is not one of the accepted modes or a range term uses an unsupported operator
+
+        Returns
+        -------
+        list of dict
+        """
+        if self._index == None:
+            raise ValueError("no librarium.SearchIndex attached for local mode")
+        if match not in MATCH_MODES:
+            raise ValueError(
+                f"match is not 'contains', 'prefix' or 'exact': {match}"
+            )
+        if self._index.stale():
+            self._index.refresh()
+        strings = {}
+        for item in ["name", "isbn", "authors", "genres", "publisher"]:
+            if terms.get(item) != None:
+                strings[item] = [term for term in terms[item] if term != ""]
+        books = []
+        ranked = self._index.search(
+            match = "substring" if match == "contains" else match,
+            **strings
+        )
+        for objectid, score in ranked:
+            book = self._index.get(objectid)
+            if not self._local_ranges(book, **terms):
+                continue
+            if match == "exact" and not self._local_exact(book, **strings):
+                continue
+            book["score"] = score
+            books.append(book)
+        for key, direction in reversed(sort):
+            books.sort(
+                key = lambda x: (x.get(key) == None, x.get(key)),
+                reverse = direction == -1
+            )
+        if fields != None:
+            wanted = set(fields) | {"_id", "score"}
+            books = [
+                {key: value for key, value in book.items() if key in wanted}
+                for book in books
+            ]
+        available = terms.get("available")
+        if books != []:
+            # The indexed copies are older than the latest checkouts, so the copy counts are read again
+            live = ["copies", "available_copies", "current_loans"]
+            current = {
+                x["_id"]: x for x in self._books.find(
+                    {"_id": {"$in": [x["_id"] for x in books]}},
+                    {field: 1 for field in live}
+                )
+            }
+            books = [x for x in books if x["_id"] in current]
+            for book in books:
+                details = current[book["_id"]]
+                borrowed = details.get("available_copies") == 0
+                for field in live:
+                    if field in book and field in details:
+                        book[field] = details[field]
+                if fields == None or "borrowed" in fields:
+                    book["borrowed"] = borrowed
+                if fields == None or "available" in fields:
+                    book["available"] = not borrowed
+            if available != None:
+                books = [
+                    x for x in books
+                    if (current[x["_id"]].get("available_copies") != 0) == available
+                ]
+        return books
+
+    def _local_ranges(self, book, **terms):
+        """
+        Check a book against the pages, words and pub_date terms of a search.
+
+        Parameters
+        ----------
+        book : dict
+            Book document
+
+        **terms : dict
+            Same as librarium.Library.search_books
+
+        Raises
+        ------
+        ValueError
+            If a range term uses an operator other than $eq, $ne, $gt, $gte, $lt or $lte
+
+        Returns
+        -------
+        matches : bool
+        """
+        operators = {
+            "$eq": lambda x, y: x == y,
+            "$ne": lambda x, y: x != y,
+            "$gt": lambda x, y: x > y,
+            "$gte": lambda x, y: x >= y,
+            "$lt": lambda x, y: x < y,
+            "$lte": lambda x, y: x <= y
+        }
+        for item in ["pages", "words", "pub_date"]:
+            conditions = [x for x in terms.get(item) or [] if x != {}]
+            if conditions == []:
+                continue
+            value = book.get(item)
+            matched = False
+            for condition in conditions:
+                if type(condition) != dict:
+                    condition = {"$eq": condition}
+                passed = True
+                for operator, bound in condition.items():
+                    if operator not in operators:
+                        raise ValueError(
+                            f"operator not supported in local mode: {operator}"
+                        )
+                    if operator == "$ne":
+                        passed = passed and value != bound
+                    elif value == None:
+                        passed = passed and operator == "$eq" and bound == None
+                    else:
+                        passed = passed and operators[operator](value, bound)
+                if passed:
+                    matched = True
+                    break
+            if not matched:
+                return False
+        return True
+
+    def _local_exact(self, book, **strings):
+        """
+        Check that every string term of a search is all of its field, as tokenized by the attached librarium.SearchIndex.
+
+        Parameters
+        ----------
+        book : dict
+            Book document
+
+        **strings : dict of str, list of str
+            String terms of the search
+
+        Returns
+        -------
+        matches : bool
+        """
+        for field, values in strings.items():
+            value = book.get(field)
+            items = value if type(value) == list else [value]
+            whole = [self._index._tokenize(field, item) for item in items]
+            for term in values:
+                if self._index._tokenize(field, term) not in whole:
+                    return False
+        return True
+
+    def _books_query(self, mode="regex", match="contains", **terms):
+        """
+        Build the MongoDB query for a book search, reusing it if the same search was built before.
+
+        Parameters
+        ----------
+        mode : "regex" or "text"
+            Same as librarium.Library.search_books
+
+        match : "contains", "prefix" or "exact"
+            Same as librarium.Library.search_books
+
+        **terms : dict
+            Same as librarium.Library.search_books
+
+        Raises
+        ------
+        ValueError
+            If mode or match is not one of the accepted modes
+
+        Returns
+        -------
+        query : dict
+        """
+        if mode not in ["regex", "text"]:
+            raise ValueError(f"mode is not 'regex', 'text' or 'local': {mode}")
+        if match not in MATCH_MODES:
+            raise ValueError(
+                f"match is not 'contains', 'prefix' or 'exact': {match}"
+            )
+        return self._cached_query(
+            ("books", mode, match, sorted(terms.items())),
+            lambda: self._compile_books_query(mode, match, terms)
+        )
+
+    def _compile_books_query(self, mode, match, terms):
+        """
+        Build the MongoDB query for a book search.
+
+        Parameters
+        ----------
+        mode, match
+            Same as librarium.Library._books_query
+
+        terms : dict
+            Same as **terms of librarium.Library.search_books
+
+        Returns
+        -------
+        query : dict
+        """
+        trmkeys = list(terms.keys())
+        and_string = ["name", "isbn", "authors", "genres", "publisher"]
+        or_int = ["pages", "words", "pub_date"]
+        text = []
+        if mode == "text":
+            and_string = ["isbn"]
+            for item in ["name", "authors", "genres", "publisher"]:
+                if item not in trmkeys:
+                    continue
+                if terms[item] == None:
+                    continue
+                text += [term for term in terms[item] if term != ""]
+        query = {"$and": []}
+        for item in and_string:
+            inner_query = {"$and": []}
+            if item not in trmkeys:
+                continue
+            if terms[item] == None:
+                continue
+            for term in terms[item]:
+                if term != "":
+                    inner_query["$and"].append(
+                        self._match_term(item, term, match, match == "contains")
+                    )
+            if inner_query != {"$and": []}:
+                query["$and"].append(inner_query)
+        for item in or_int:
+            inner_query = {"$or": []}
+            if item not in trmkeys:
+                continue
+            if terms[item] == None:
+                continue
+            for term in terms[item]:
+                if term != {}:
+                    inner_query["$or"].append({item: term})
+            if inner_query != {"$or": []}:
+                query["$and"].append(inner_query)
+        if terms.get("available") == True:
+            query["$and"].append({"available_copies": {"$ne": 0}})
+        elif terms.get("available") == False:
+            query["$and"].append({"available_copies": 0})
+        if query == {"$and": []}:
+            query = {}
+        if text != []:
+            query["$text"] = {"$search": " ".join(text)}
+        return query
+
+    def delete_book(self, objectid):
+        """
+        Delete a book with a matching objectid
+
+        Example
+        -------
+
+            >>> book_id = client.find_books(
+                name = "Trump",
+                exact = False,
+                insensitive = False
+            )[0]
+            >>> client.delete_book(book_id)
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            BSON ObjectId of book
+
+        Raises
+        ------
+        TypeError
+            objectid is not a BSON ObjectId
+
+        Returns
+        -------
+        info : None or dict
+            Info about deleted book or None if book not found
+        """
+        if type(objectid) != bson.objectid.ObjectId:
+            raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
+        if self._index != None:
+            self._index.remove(objectid)
+        self._invalidate("book", objectid)
+        return self._books.find_one_and_delete({"_id": objectid})
+
+    # BORROWERS #
+
+    def get_borrower(self, objectid, loans="full", fields=None):
+        """
+        Get details of borrower with just objectid
+
+        Notes
+        -----
+        Served from the cache if enabled with librarium.Library.enable_cache.
+
+        Example
+        -------
+
+            >>> details = client.get_borrower(
+                bson.objectid.ObjectId("507f191e810c19729de860ea"),
+                loans = "count"
+            )
+            >>> print(details["loan_count"])
+            2
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            BSON ObjectId of borrower
+
+        loans : "full", "count" or None
+            How to attach outstanding loans. "full" stores the loan documents under "loans", "count" stores only their number under "loan_count" and None attaches nothing
+
+        fields : None or list of str
+            Fields of the borrower to fetch, _id always included. Every field if None
+
+        Raises
+        ------
+        TypeError
+            If objectid is not a BSON ObjectId or fields is not a list of strings
+
+        ValueError
+            If loans is not one of the accepted modes
+
+        Returns
+        -------
+        details : None or dict
+            Details of the borrower. None if borrower not found
+        """
+        if type(objectid) != bson.objectid.ObjectId:
+            raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
+        key = ("borrower", objectid, loans, repr(fields))
+        hit, details = self._cache_get(key)
+        if hit:
+            return details
+        details = self._borrowers.find_one(
+            {"_id": objectid},
+            self._projection(fields)
+        )
+        if details != None:
+            details = self._attach_loans([details], loans)[0]
+        self._cache_put(key, details)
+        return details
+
+    def find_borrowers(self, username, exact=True, insensitive=False, limit=0):
+        """
+        Find borrower(s) with username.
+
+        Notes
+        -----
+        An exact lookup is a plain equality, served by the librarium_username index or, if insensitive, by the case-insensitive librarium_username_ci index, so it returns at most one borrower.
+
+        Example
+        -------
+
+        >>> client.find_borrower(
+            username = "timmytom"
+        )
+        ObjectId(...)
+
+        Parameters
+        ----------
+        username : str
+            Username of the borrower
+
+        exact : bool
+            Whether username must be the borrower's whole username or may appear anywhere in it. username is matched literally either way
+
+        insensitive : bool
+            Case insensitivity
+
+        limit : int
+            Maximum number of ObjectIds to return. No limit if 0
+
+        Raises
+        ------
+        AttributiveError
+            If borrower collection not connected yet
+
+        TypeError
+            If name is not a string or capital is not a boolean
+
+        Returns
+        -------
+        borrower_ids : list of bson.objectid.ObjectId
+            ObjectIds of borrowers with the requested name
+        """
+        if type(username) != str:
+            raise TypeError(f"username is not a string: {name}")
+        if exact:
+            borrowers = self._borrowers.find(
+                {"username": username},
+                {"_id": 1},
+                collation = CASE_INSENSITIVE if insensitive else None
+            ).limit(limit)
+        else:
+            borrowers = self._borrowers.find(
+                self._match_term("username", username, "contains", insensitive),
+                {"_id": 1}
+            ).limit(limit)
+        borrower_ids = [x["_id"] for x in borrowers]
+        return borrower_ids
+
+    def borrower_exists(self, objectid):
+        """
+        Check if borrower exists with ObjectId.
+
+        Example
+        -------
+
+            >>> client.borrower_exists(
+                bson.objectid.ObjectId(
+                    "5f019ed2ffd6b60fae41212f"
+                )
+            )
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId or None
+            Borrower objectid
+
+        Raises
+        ------
+        TypeError
+            If objectid is not a BSON ObjectId
+
+        Returns
+        -------
+        exists : bool
+            Whether borrower exists
+        """
+        if objectid == [] or objectid == None:
+            return False
+        if type(objectid) != bson.objectid.ObjectId:
+            raise TypeError("objectid is not a BSON ObjectId")
+        borrower = self._borrowers.find_one(
+            {"_id": objectid},
+            {"_id": 1}
+        )
+        return borrower != None
+
+    def username_conflicts(self):
+        """
+        Find usernames that only differ in case.
+
+        Notes
+        -----
+        Such borrowers were allowed before usernames became unique regardless of case, and stop librarium.Library.ensure_indexes from building librarium_username_ci until all but one of each group are renamed or deleted.
+
+        Example
+        -------
+
+            >>> client.username_conflicts()
+            [['Tim', 'tim']]
+
+        Returns
+        -------
+        conflicts : list of list of str
+            Usernames of each group of conflicting borrowers
+        """
+        return [
+            sorted(x["usernames"]) for x in self._borrowers.aggregate(
+                [
+                    {
+                        "$group": {
+                            "_id": {"$toLower": "$username"},
+                            "usernames": {"$push": "$username"},
+                            "count": {"$sum": 1}
+                        }
+                    },
+                    {"$match": {"count": {"$gt": 1}}}
+                ]
+            )
+        ]
+
+    def authenticate(self, username, password):
+        """
+        Check a borrower's username and password with a single indexed lookup.
+
+        Notes
+        -----
+        The username is matched exactly but ignoring case through the librarium_username_ci index, and only _id, name and password are fetched. The password is compared locally in constant time. Outstanding loans are not fetched; use librarium.Library.get_borrower when they are needed.
+
+        Example
+        -------
+
+            >>> client.authenticate("timmytom", "youwontguessthisxd")
+            {'_id': ObjectId('...'), 'name': 'Timothy Tom'}
+
+        Parameters
+        ----------
+        username : str
+            Username of the borrower
+
+        password : str
+            Password to check
+
+        Raises
+        ------
+        TypeError
+            If username or password is not a string
+
+        Returns
+        -------
+        details : None or dict
+            _id and name of the borrower. None if the username or password is wrong
+        """
+        if type(username) != str:
+            raise TypeError(f"username is not a string: {username}")
+        if type(password) != str:
+            raise TypeError("password is not a string")
+        details = self._borrowers.find_one(
+            {"username": username},
+            {"_id": 1, "name": 1, "password": 1},
+            collation = CASE_INSENSITIVE
+        )
+        if details == None or type(details.get("password")) != str:
+            return None
+        if not hmac.compare_digest(
+            details.pop("password").encode("utf-8"),
+            password.encode("utf-8")
+        ):
+            return None
+        return details
+
+    def add_borrower(self, username, password, name, phone, email, address):
+        """
+        Add a borrower into collection.
+
+        Notes
+
+        Example
+        -------
+
+            >>> id = client.add_borrower(
+                username = "timtam-chocolates",
+                password = "youwontguessthisxd",
+                name = "Tim Tom",
+                phone = "999"
+                email = "fake_email@liame.com",
+                address = "123 Tuas Link S147258",
+                skip = False
+            )
+            >>> print(id)
+            ObjectId('...')
+
+        Parameters
+        ----------
+        username : str
+            Username of the borrower
+
+        password : str
+            Password used to
+
+        name : str
+            Real life name of the borrower
+
+        phone : str
+            Phone number of borrower. Can have separation marks
+
+        email : str
+            Email of the borrower
+
+        address : str
+            Home address of the borrower
+
+        Raises
+        ------
+        AttributeError
+            If borrower collection not connected to yet
+
+        TypeError
+            If any of the parameters given are not correct in their data type
+
+        ValueError
+            If borrower with the same username found, ignoring case
+
+        Returns
+        -------
+        borrower.inserted_id : bson.objectid.ObjectId
+            ObjectId of the borrower added to the collection
+        """
+        found = self.find_borrowers(username,True,True,1)
+        if found != []:
+            raise ValueError(
+                f"borrower with the same username found: {username}"
+            )
+        document = self._borrower_document(
+            username, password, name, phone, email, address
+        )
+        return self._borrowers.insert_one(document).inserted_id
+
+    def _borrower_document(self, username, password, name, phone, email, address, **kwargs):
+        """
+        Build a borrower document following the rules of librarium.Library.add_borrower.
+
+        Parameters
+        ----------
+        username, password, name, phone, email, address : str
+            Same as librarium.Library.add_borrower
+
+        **kwargs : dict
+            Other fields, such as _id and last_updated in exported borrowers, which are ignored
+
+        Raises
+        ------
+        TypeError
+            If any of the parameters given are not correct in their data type
+
+        Returns
+        -------
+        document : dict
+            Borrower document ready to be inserted
+        """
+        if type(username) != str:
+            raise TypeError("username is not a string")
+        if type(password) != str:
+            raise TypeError("password is not a string")
+        if type(name) != str:
+            raise TypeError("name is not a string")
+        if type(phone) != str:
+            raise TypeError("phone is not a string")
+        if type(email) != str:
+            raise TypeError("email is not a string")
+        if type(address) != str:
+            raise TypeError("address is not a string")
+        document = {
+            "username": username,
+            "password": password,
+            "name": name,
+            "phone": phone,
+            "email": email,
+            "address": address,
+            "open_loans": 0,
+            "last_updated": datetime.datetime.utcnow()
+        }
+        return document
+
+    def update_borrower(self, objectid, **kwargs):
+        """
+        Update a borrower in the collection
+
+        Example
+        -------
+
+            >>> id = client.add_borrower(
+                username = "yamai",
+                password = "password",
+                name = "Josg Michael Tmg",
+                phone = "999",
+                address = "123 Tuas Link S147258"
+                email = "creative.name@coolmail.biz.su"
+            )
+            >>> client.update_borrower(
+                objectid = id,
+                name = "Josh Michael Tng"
+            )
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            ObjectId of wanted borrower
+
+        **kwargs : dict
+            password : str
+                Password used to
+            name : str
+                Real life name of the borrower
+            phone : str
+                Phone number of the borrower
+            email : str
+                Email of the borrower
+            address : str
+                Home address of the borrower
+
+        Raises
+        ------
+        TypeError
+            If type of kwargs parameters are not the correct type
+
+        ValueError
+            If email is not a valid email
+        """
+        if type(objectid) != bson.objectid.ObjectId:
+            raise TypeError("objectid is not a BSON ObjectId")
+        document = self._borrower_changes(**kwargs)
+        self._borrowers.update_one(
+            {"_id": objectid},
+            {"$set": document}
+        )
+        self._invalidate("borrower", objectid)
+
+    def _borrower_changes(self, **kwargs):
+        """
+        Build the fields to set on a borrower following the rules of librarium.Library.update_borrower.
+
+        Parameters
+        ----------
+        **kwargs : dict
+            Same as librarium.Library.update_borrower. Unknown keys are ignored
+
+        Raises
+        ------
+        TypeError
+            If type of kwargs parameters are not the correct type
+
+        Returns
+        -------
+        document : dict
+            Fields to set on the borrower
+        """
+        keywords = [
+            "password",
+            "name",
+            "phone",
+            "email",
+            "address"
+        ]
+        document = {}
+        for key, value in kwargs.items():
+            if key not in keywords:
+                continue
+            if type(value) != str:
+                raise TypeError(
+                    f"{value} associated with {key} is not a string"
+                )
+            document[key] = value
+        document["last_updated"] = datetime.datetime.utcnow()
+        return document
+
+    def add_borrowers(self, borrowers, update=False, bulk=False, batch_size=1000):
+        """
+        Add multiple borrowers to collection.
+
+        Notes
+        -----
+        With update, each batch of borrowers costs one query to find the usernames that already exist and one bulk_write of upserts. New borrowers are checked with the rules of librarium.Library.add_borrower and existing ones with those of librarium.Library.update_borrower. Borrowers sharing a username within the input are merged, later values winning.
+
+        In bulk mode without update, borrowers are inserted through unordered insert_many batches and duplicate usernames are caught by the unique username index.
+
+        Example
+        -------
+
+            >>> borrowers = [
+                {
+                    username = "timtam-chocolates",
+                    password = "youwontguessthisxd",
+                    name = "Tim Tom",
+                    phone = "999",
+                    email = "fake_email@liame.com",
+                    address = "123 Tuas Link S147258"
+                },
+                {
+                    username = "yamai",
+                    password = "password",
+                    name = "Josh Michael Tng",
+                    phone = "743978932",
+                    address = "123 Tuas Link S147258"
+                    email = "creative.name@coolmail.biz"
+                }
+            ]
+            >>> print(borrowers, update=False)
+            [ObjectId('...'),ObjectId('...')]
+
+        Parameters
+        ----------
+        borrowers : list of dict of str
+            List of borrowers with parameters to be inputted into the system. Available parameters are listed in self.add_borrower()
+
+        update : bool
+            Whether to update if the borrower with the same username is found
+
+        bulk : bool
+            Whether to report errors per borrower instead of raising on the first one
+
+        batch_size : int
+            Number of borrowers sent per write
+
+        Raises
+        ------
+        AttributeError
+            If borrower collection not connected to yet
+
+        KeyError
+            If mandatory keys are missing
+
+        TypeError
+            If any of the parameters given are not correct in their data type or name is missing
+
+        ValueError
+            If erroneous date inputted
+
+        Returns
+        -------
+        borrower_ids : list of bson.objectid.ObjectId
+            List of ObjectIds of the borrowers added to the library.
+
+        errors : list of dict
+            Only returned in bulk mode. The index and error message of every borrower not written, whose ObjectId in borrower_ids is None
+        """
+        if update:
+            borrower_ids, errors = self._upsert_borrowers(
+                borrowers, batch_size, strict = not bulk
+            )
+        elif bulk:
+            borrower_ids, errors = self._insert_batches(
+                self._borrowers,
+                borrowers,
+                lambda borrower: self._borrower_document(**borrower),
+                batch_size
+            )
+        else:
+            return [self.add_borrower(**borrower) for borrower in borrowers]
+        if bulk:
+            return borrower_ids, errors
+        return borrower_ids
+
+    def _upsert_borrowers(self, borrowers, batch_size=1000, strict=True):
+        """
+        Insert or update borrowers by username in batches of upserts.
+
+        Parameters
+        ----------
+        borrowers : iterable of dict of str
+            Borrowers with the parameters of librarium.Library.add_borrower
+
+        batch_size : int
+            Number of borrowers per batch
+
+        strict : bool
+            Whether to raise on the first invalid borrower or failed write instead of reporting it
+
+        Raises
+        ------
+        BulkWriteError
+            If strict and a write failed
+
+        KeyError
+            If strict and a borrower has no username
+
+        TypeError
+            If strict and a borrower has a parameter of the wrong data type
+
+        ValueError
+            If batch_size is smaller than 1
+
+        Returns
+        -------
+        ids : list of None or bson.objectid.ObjectId
+            ObjectId of each borrower in input order. None if the borrower was not written
+
+        errors : list of dict
+            index : int
+                Position of the borrower in the input
+            error : str
+                Why the borrower was not written
+        """
+        if type(batch_size) != int or batch_size < 1:
+            raise ValueError(f"batch_size is not a positive integer: {batch_size}")
+        ids = []
+        errors = []
+        batch = []
+
+        def fail(index, error):
+            if strict:
+                raise error
+            ids[index] = None
+            errors.append({"index": index, "error": str(error)})
+
+        def flush():
+            if batch == []:
+                return
+            # Usernames are unique regardless of case, so borrowers are keyed by the folded username
+            usernames = list({borrower["username"] for _, borrower in batch})
+            existing = {
+                x["username"].casefold(): x["_id"] for x in self._borrowers.find(
+                    {"username": {"$in": usernames}},
+                    {"username": 1},
+                    collation = CASE_INSENSITIVE
                 )
-            else:
-                raise TypeError(
-                    f"{item} is not datetime.datetime or dictionary"
+            }
+            pending = {}
+            for index, borrower in batch:
+                username = borrower["username"].casefold()
+                try:
+                    if username in existing or username in pending:
+                        changes = self._borrower_changes(**borrower)
+                    else:
+                        changes = self._borrower_document(**borrower)
+                        del changes["username"]
+                        del changes["open_loans"]
+                except (KeyError, TypeError, ValueError) as e:
+                    fail(index, e)
+                    continue
+                if username not in pending:
+                    pending[username] = {
+                        "username": borrower["username"],
+                        "set": {},
+                        "indices": [],
+                        "_id": borrower.get("_id")
+                    }
+                pending[username]["set"].update(changes)
+                pending[username]["indices"].append(index)
+            batch.clear()
+            if pending == {}:
+                return
+            order = list(pending.keys())
+            operations = []
+            inserting = {}
+            for username in order:
+                if username in existing:
+                    operations.append(
+                        pymongo.UpdateOne(
+                            {"username": pending[username]["username"]},
+                            {"$set": pending[username]["set"]},
+                            collation = CASE_INSENSITIVE
+                        )
+                    )
+                    continue
+                inserting[username] = pending[username]["_id"]
+                if type(inserting[username]) != bson.objectid.ObjectId:
+                    inserting[username] = bson.objectid.ObjectId()
+                operations.append(
+                    pymongo.UpdateOne(
+                        {"username": pending[username]["username"]},
+                        {
+                            "$set": pending[username]["set"],
+                            "$setOnInsert": {
+                                "_id": inserting[username],
+                                "username": pending[username]["username"],
+                                "open_loans": 0
+                            }
+                        },
+                        upsert = True,
+                        collation = CASE_INSENSITIVE
+                    )
                 )
-        document["last_updated"] = datetime.datetime.utcnow()
-        book = self._books.insert_one(document)
-        return book.inserted_id
-
-    def update_book(self, objectid, **kwargs):
+            self._invalidate(
+                "borrower",
+                *[existing[username] for username in order if username in existing]
+            )
+            try:
+                result = self._borrowers.bulk_write(operations, ordered=False)
+                upserted = set(result.upserted_ids.values())
+                failed = {}
+            except pymongo.errors.BulkWriteError as e:
+                if strict:
+                    raise
+                upserted = {x["_id"] for x in e.details["upserted"]}
+                failed = {
+                    x["index"]: x["errmsg"] for x in e.details["writeErrors"]
+                }
+            for username, id in inserting.items():
+                if id in upserted:
+                    existing[username] = id
+            unresolved = [
+                username for position, username in enumerate(order)
+                if username not in existing and position not in failed
+            ]
+            if unresolved != []:
+                for x in self._borrowers.find(
+                    {"username": {"$in": [pending[username]["username"] for username in unresolved]}},
+                    {"username": 1},
+                    collation = CASE_INSENSITIVE
+                ):
+                    existing[x["username"].casefold()] = x["_id"]
+            for position, username in enumerate(order):
+                for index in pending[username]["indices"]:
+                    if position in failed:
+                        fail(index, pymongo.errors.WriteError(failed[position]))
+                    else:
+                        ids[index] = existing.get(username)
+
+        for index, borrower in enumerate(borrowers):
+            ids.append(None)
+            if type(borrower) != dict or "username" not in borrower:
+                fail(index, KeyError(f"borrower has no username: {borrower}"))
+                continue
+            if type(borrower["username"]) != str:
+                fail(index, TypeError("username is not a string"))
+                continue
+            batch.append((index, borrower))
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+        errors.sort(key=lambda error: error["index"])
+        return ids, errors
+
+    def import_borrowers(self, filepath, update=False, bulk=False, batch_size=1000):
         """
-        Update a book in the collection
+        Import borrowers from a JSON, JSON Lines or BSON file.
+
+        Notes
+        -----
+        The JSON file should have an array as the first-level data. JSON Lines files (.jsonl or .ndjson) hold one borrower per line. BSON files hold concatenated documents, as written by mongodump. MongoDB extended JSON such as {"$oid": ...} is understood, so files written by librarium.Library.export_borrowers can be imported back, and in bulk mode each document keeps its _id. Borrowers are read from the file one at a time as they are written, so the whole file is never held in memory.
 
         Example
         -------
 
-            >>> id = client.add_book(
-                name = "Trump: The Art of the Deal",
-                authors = [
-                    "Donald John Trump",
-                    "Tony Schwartz"
-                ],
-                isbn = "0-394-55528-7",
-                genres = [
-                    "Business"
-                ]
-                pages = 372
-                words = 86855
-                pub_date = {
-                    "year": 1969, # Erroneous data
-                    "month": 11,
-                    "day": 1
-                },
-                publisher = "Random House"
-            )
-            >>> client.update_book(
-                objectid = id
-                pub_date = {
-                    "year": 1987,
-                    "month": 11,
-                    "day": 1
-                }
+            >>> borrowers = client.import_borrowers(
+                filepath = pathlib.Path("borrowers.json"),
+                update = True
             )
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId
-            ObjectId of wanted book
+        filepath : str or pathlib.Path
+            File path in string or pathlib.Path form (recommended)
 
-        **kwargs : dict
-            name : str
-                Name of the book
-            authors : str or list of str
-                Author name or list of authors' names
-            isbn : str
-                International standard book number of the book
-            genres : str or list of str
-                Genres of the book
-            pages : int
-                Number of pages
-            words : int
-                Number of words
-            pub_date : datetime.datetime or dict of int
-                Date of the book's writing or dictionary of year, month and day
-            publisher : str or list of str
-                Name or names of publishers
+        update : bool
+            Whether to update if the borrower if a borrower with the same name is found
+
+        bulk : bool
+            Whether to report errors per borrower. See librarium.Library.add_borrowers
+
+        batch_size : int
+            Number of borrowers sent per write
+
+        Raises
+        ------
+        FileNotFoundError
+            File with the requested name through the requested path not found
+
+        TypeError
+            If filepath is not a string or pathlib.Path
+
+        ValueError
+            If file is not a JSON, JSON Lines or BSON file
+
+        Returns
+        -------
+        borrowers_id : list of bson.objectid.ObjectId
+
+        errors : list of dict
+            Only returned in bulk mode. See librarium.Library.add_borrowers
         """
-        kwkeys = list(kwargs.keys())
-        if not self.book_exists(objectid):
-            raise ValueError(
-                f"Book with requested ObjectId does not exist: {objectid}"
+        data = self._read_records(filepath)
+        return self.add_borrowers(
+            data,
+            update = update,
+            bulk = bulk,
+            batch_size = batch_size
+        )
+
+    def export_borrowers(self, filepath, format=None, compression=None, batch_size=1000, query=None, fields=None):
+        """
+        Export borrowers to a JSON Lines, BSON or CSV file.
+
+        Notes
+        -----
+        Streamed to the file by librarium.Library._export, whose notes cover memory use and BSON output.
+
+        Example
+        -------
+
+            >>> count = client.export_borrowers(
+                filepath = pathlib.Path("borrowers.bson")
             )
-        document = {}
-        list_of_str = ["authors", "genres", "publisher"]
-        for item in list_of_str:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            if type(kwargs[item]) == list:
-                for entity in kwargs[item]:
-                    document[item].append(
-                        str(entity)
-                    )
-            else:
-                document[item].append(
-                    str(kwargs[item])
-                )
-        string = ["name", "isbn"]
-        for item in string:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            document[item] = str(kwargs[item])
-        integer = ["pages", "words"]
-        for item in integer:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            document[item] = int(kwargs[item])
-        date_and_time = ["pub_date"]
-        for item in date_and_time:
-            if item not in kwkeys:
-                continue
-            if kwargs[item] == None:
-                continue
-            if type(kwargs[item]) == datetime.datetime:
-                document[item] = kwargs[item]
-            elif type(kwargs[item]) == dict:
-                document[item] = datetime.datetime(
-                    year = kwargs[item]["year"],
-                    month = kwargs[item]["month"],
-                    day = kwargs[item]["day"]
-                )
-            else:
-                raise TypeError(
-                    f"{item} is not datetime.datetime or dictionary"
-                )
-        document["last_updated"] = datetime.datetime.utcnow()
-        self._books.update_one(
-            {"_id": objectid},
-            {"$set": document}
+
+        Parameters
+        ----------
+        filepath : str or pathlib.Path
+            File path in string or pathlib.Path form (recommended)
+
+        format : None, "jsonl", "bson" or "csv"
+            Format of the file. Worked out from the suffix of filepath (.jsonl, .ndjson, .bson or .csv) if None
+
+        compression : None, "none", "gzip" or "zstd"
+            Compression of the file. Worked out from the suffix of filepath (.gz or .zst) if None. zstd requires the zstandard package
+
+        batch_size : int
+            Number of documents fetched from the server per round trip
+
+        query : None or dict
+            MongoDB query selecting the documents to export. Every document if None
+
+        fields : None or list of str
+            Fields to export. Every field if None, or the columns in librarium.CSV_FIELDS for CSV
+
+        Raises
+        ------
+        ImportError
+            If zstd compression is requested but zstandard is not installed
+
+        TypeError
+            If filepath is not a string or pathlib.Path
+
+        ValueError
+            If the format or compression is unknown or cannot be worked out from filepath
+
+        Returns
+        -------
+        count : int
+            Number of documents written
+        """
+        return self._export(
+            self._borrowers,
+            "borrowers",
+            filepath,
+            format,
+            compression,
+            batch_size,
+            query,
+            fields
         )
 
-    def add_books(self, books):
+    def search_borrowers(self, sort=[], loans="full", fields=None, match="contains", **terms):
         """
-        Add multiple books to collection.
+        Search books based on different available queries.
+
+        Notes
+        -----
+        Terms are matched literally. With the default "contains" match a term may appear anywhere in its field, ignoring case. "prefix" and "exact" are case sensitive and anchored, so username terms use the username index from librarium.INDEXES.
 
         Example
         -------
 
-            >>> books = [
-                {
-                    name = "Trump: The Art of the Deal",
-                    authors = [
-                        "Donald John Trump",
-                        "Tony Schwartz"
-                    ],
-                    isbn = "0-394-55528-7",
-                    genres = [
-                        "Business"
-                    ]
-                    pages = 372
-                    words = 86855
-                    pub_date = {
-                        "year": 1987,
-                        "month": 11,
-                        "day": 1
-                    },
-                    publisher = "Random House"
-                },
-                {
-                    name = "A Pickle for the Knowing Ones",
-                    authors = [
-                        "Timothy Dexter"
-                    ],
-                    isbn = "978-0-344-45584-1",
-                    genres = [
-                        "Politics"
-                    ]
-                    pages = 37
-                    words = None
-                    pub_date = {
-                        "year": 1797,
-                        "month": 1,
-                        "day": 22
-                    },
-                    publisher = "Random House"
-                }
-            ]
-            >>> print(books)
-            [ObjectId('...'),ObjectId('...')]
+            >>> info = client.search_books(
+                name = ["Josh"]
+            )
+            >>> print(info)
+            [{data}]
 
         Parameters
         ----------
-        books : list of dict of str, int, datetime.datetime, list of str or dict of int
-            List of books with parameters to be inputted into the system. Parameters should match the **kwargs format in librarium.Library.add_books
+        sort : list of tuple, int
+            How to sort items
+
+        loans : "full", "count" or None
+            How to attach outstanding loans to each borrower. See librarium.Library.get_borrower
+
+        fields : None or list of str
+            Fields of each borrower to return. Every field if None
+
+        match : "contains", "prefix" or "exact"
+            Whether each term may appear anywhere in its field, must start it or must be all of it
+
+        **terms : dict
+            username : list of str
+            password : list of str
+            name : list of str
+            phone : list of str
+            email : list of str
+            address : list of str
 
         Raises
         ------
         AttributeError
-            If book collection not connected to yet
+            If borrower collection not connected to yet
 
         KeyError
             If mandatory keys are missing
 
         TypeError
-            If any of the parameters given are not correct in their data type or name is missing
+            If any of the parameters given are not correct in their data type or **terms is missing
 
         ValueError
-            If erroneous date inputted
+            If erroneous date inputted or match is not one of the accepted modes
 
         Returns
         -------
-        book_ids : list of bson.objectid.ObjectId
-            List of ObjectIds of the books added to the library.
+        list of dict
         """
-        return [self.add_book(**book) for book in books]
+        query = self._borrowers_query(match, **terms)
+        projection = self._projection(fields)
+        if sort == []:
+            borrowers = list(self._borrowers.find(query, projection))
+        else:
+            borrowers = list(self._borrowers.find(query, projection).sort(sort))
+        return self._attach_loans(borrowers, loans)
 
-    def import_books(self, filepath):
+    def iter_borrowers(self, sort=[], loans="full", batch_size=100, fields=None, match="contains", **terms):
         """
-        Import books from a JSON or BSON file.
+        Lazily search borrowers based on different available queries.
 
         Notes
         -----
-        The JSON and BSON file should have an array as the first-level data.
+        Borrowers are yielded as the server-side cursor delivers them. Outstanding loans are attached batch_size borrowers at a time with one grouped query per batch.
 
         Example
         -------
 
-            >>> books = client.import_books(
-                filepath = pathlib.Path("books.json")
+            >>> for borrower in client.iter_borrowers(loans = "count"):
+                    print(borrower["username"], borrower["loan_count"])
+
+        Parameters
+        ----------
+        sort : list of tuple, int
+            How to sort items
+
+        loans : "full", "count" or None
+            How to attach outstanding loans to each borrower. See librarium.Library.get_borrower
+
+        batch_size : int
+            Number of borrowers fetched from the server and given loans per round trip
+
+        fields : None or list of str
+            Fields of each borrower to return. Every field if None
+
+        match : "contains", "prefix" or "exact"
+            See librarium.Library.search_borrowers
+
+        **terms : dict
+            Same as librarium.Library.search_borrowers
+
+        Yields
+        ------
+        dict
+        """
+        query = self._borrowers_query(match, **terms)
+        cursor = self._borrowers.find(
+            query,
+            self._projection(fields),
+            batch_size = batch_size
+        )
+        if sort != []:
+            cursor = cursor.sort(sort)
+        with cursor:
+            batch = []
+            for borrower in cursor:
+                batch.append(borrower)
+                if len(batch) >= batch_size:
+                    yield from self._attach_loans(batch, loans)
+                    batch = []
+            yield from self._attach_loans(batch, loans)
+
+    def page_borrowers(self, after=None, limit=20, key="_id", direction=1, loans="full", fields=None, match="contains", **terms):
+        """
+        Get one page of a borrower search with keyset pagination.
+
+        Example
+        -------
+
+            >>> borrowers, after = client.page_borrowers(
+                limit = 20,
+                key = "username"
             )
 
         Parameters
         ----------
-        filepath : str or pathlib.Path
-            File path in string or pathlib.Path form (recommended)
+        after, limit, key, direction
+            Same as librarium.Library.page_books
+
+        loans : "full", "count" or None
+            How to attach outstanding loans to each borrower. See librarium.Library.get_borrower
+
+        fields : None or list of str
+            Fields of each borrower to return. Every field if None. key is always returned
+
+        match : "contains", "prefix" or "exact"
+            See librarium.Library.search_borrowers
+
+        **terms : dict
+            Same as librarium.Library.search_borrowers
 
         Raises
         ------
-        FileNotFoundError
-            File with the requested name through the requested path not found
-
         TypeError
-            If filepath is not a string or pathlib.Path
+            If after does not match key
 
         ValueError
-            If file is not a JSON or BSON file
+            If limit is smaller than 1 or direction is not 1 or -1
 
         Returns
         -------
-        books_id : list of bson.objectid.ObjectId
+        borrowers : list of dict
+
+        after : None, bson.objectid.ObjectId or tuple
+            What to pass as after for the next page. None if the page is short of limit, so there are no more pages
         """
-        decoder = ""
-        file = None
-        if type(filepath) == str:
-            if filepath.endswith(".json"):
-                decoder = "JSON"
-            elif filepath.endswith(".bson"):
-                decoder = "BSON"
-            else:
-                raise ValueError("file is not a JSON or BSON file")
-        elif type(filepath) == pathlib.Path:
-            if filepath.suffix == ".json":
-                decoder = "JSON"
-            elif filepath.suffix == ".bson":
-                decoder = "BSON"
-            else:
-                raise ValueError("file is not a JSON or BSON file")
-        else:
-            raise TypeError("filepath is not a string or pathlib.Path")
-        if decoder == "JSON":
-            data = json.load(open(filepath, "r"))
-        elif decoder == "BSON":
-            data = bson.loads(open(filepath,"r").read())
-        return self.add_books(data)
+        query, sort = self._keyset(
+            self._borrowers_query(match, **terms), after, limit, key, direction
+        )
+        if fields != None and key not in fields:
+            fields = fields + [key]
+        borrowers = list(
+            self._borrowers.find(
+                query,
+                self._projection(fields)
+            ).sort(sort).limit(limit)
+        )
+        return (
+            self._attach_loans(borrowers, loans),
+            self._next_after(borrowers, limit, key)
+        )
 
-    def search_books(self, sort=[], **terms):
+    def count_borrowers(self, match="contains", **terms):
         """
-        Search books based on different available queries.
+        Count borrowers matching search terms without fetching them.
 
         Example
         -------
 
-            >>> info = client.search_books(
-                sort = [("isbn",1)],
-                name = ["Trump: The Art of"],
-                authors = ["Donald John", "Timot"],
-                isbn = ["0-394"],
-                genres = ["Business"],
-                pages = [{"$gte": 370, "$lte": 375}]
-                words = [{"$gte": 80000, "$lte": 90000}],
-                pub_date = [
-                    {
-                        "$lte": datetime.datetime(1988,1,1),
-                        "$gte": datetime.datetime(1986,1,1)
-                    }
-                ]
-                publisher = ["Random House"],
+            >>> client.count_borrowers(
+                name = ["Josh"]
             )
-            >>> print(info)
-            [{data}]
+            3
 
         Parameters
         ----------
-        sort : list of tuple of str, int
-            How to sort returned items
+        match : "contains", "prefix" or "exact"
+            See librarium.Library.search_borrowers
 
         **terms : dict
-            name : list of str
-            authors : list of str
-            isbn : list of str
-            genres : list of str
-            pages : list of dict of int
-            words : list of dict of int
-            pub_date : list of dict of datetime.datetime
-            publisher : list of str
+            Same as librarium.Library.search_borrowers
+
+        Returns
+        -------
+        count : int
+        """
+        return self._borrowers.count_documents(
+            self._borrowers_query(match, **terms)
+        )
+
+    def _borrowers_query(self, match="contains", **terms):
+        """
+        Build the MongoDB query for a borrower search, reusing it if the same search was built before.
+
+        Parameters
+        ----------
+        match : "contains", "prefix" or "exact"
+            Same as librarium.Library.search_borrowers
+
+        **terms : dict
+            Same as librarium.Library.search_borrowers
 
         Raises
         ------
-        AttributeError
-            If book collection not connected to yet
+        ValueError
+            If match is not one of the accepted modes
 
-        KeyError
-            If mandatory keys are missing
+        Returns
+        -------
+        query : dict
+        """
+        if match not in MATCH_MODES:
+            raise ValueError(
+                f"match is not 'contains', 'prefix' or 'exact': {match}"
+            )
+        return self._cached_query(
+            ("borrowers", match, sorted(terms.items())),
+            lambda: self._compile_borrowers_query(match, terms)
+        )
 
-        TypeError
-            If any of the parameters given are not correct in their data type or **terms is missing
+    def _compile_borrowers_query(self, match, terms):
+        """
+        Build the MongoDB query for a borrower search.
 
-        ValueError
-            If erroneous date inputted
+        Parameters
+        ----------
+        match : "contains", "prefix" or "exact"
+            Same as librarium.Library.search_borrowers
+
+        terms : dict
+            Same as **terms of librarium.Library.search_borrowers
 
         Returns
         -------
-        list of dict
+        query : dict
         """
         trmkeys = list(terms.keys())
-        and_string = ["name", "isbn", "authors", "genres", "publisher"]
-        or_int = ["pages", "words", "pub_date"]
+        and_string = [
+            "username",
+            "password",
+            "name",
+            "phone",
+            "email",
+            "address"
+        ]
         query = {"$and": []}
         for item in and_string:
             inner_query = {"$and": []}
@@ -900,49 +3844,75 @@ class Library:
             for term in terms[item]:
                 if term != "":
                     inner_query["$and"].append(
-                        {item: {"$regex": term, "$options": "i"}}
+                        self._match_term(item, term, match, match == "contains")
                     )
             if inner_query != {"$and": []}:
                 query["$and"].append(inner_query)
-        for item in or_int:
-            inner_query = {"$or": []}
-            if item not in trmkeys:
-                continue
-            if terms[item] == None:
-                continue
-            for term in terms[item]:
-                if term != {}:
-                    inner_query["$or"].append({item: term})
-            if inner_query == {"$or": []}:
-                query["$and"].append(inner_query)
         if query == {"$and": []}:
             query = {}
-        if sort == []:
-            books = list(self._books.find(query))
+        return query
+
+    def _attach_loans(self, borrowers, loans="full"):
+        """
+        Attach outstanding loans to borrowers with one grouped query.
+
+        Parameters
+        ----------
+        borrowers : list of dict
+            Borrower documents
+
+        loans : "full", "count" or None
+            How to attach outstanding loans. See librarium.Library.get_borrower
+
+        Raises
+        ------
+        ValueError
+            If loans is not one of the accepted modes
+
+        Returns
+        -------
+        borrowers : list of dict
+            The same borrower documents with "loans" or "loan_count" added
+        """
+        if loans not in ["full", "count", None]:
+            raise ValueError(f"loans is not 'full', 'count' or None: {loans}")
+        if loans == None or borrowers == []:
+            return borrowers
+        if loans == "full":
+            accumulator = {"$push": "$$ROOT"}
+            key, default = "loans", []
         else:
-            books = list(self._books.find(query).sort(sort))
-        for book in range(len(books)):
-            books[book]["borrowed"] = self.book_borrowed(books[book]["_id"])
-        return books
+            accumulator = {"$sum": 1}
+            key, default = "loan_count", 0
+        groups = self._loans.aggregate(
+            [
+                {
+                    "$match": {
+                        "borrower": {"$in": [x["_id"] for x in borrowers]},
+                        "returned": False
+                    }
+                },
+                {"$group": {"_id": "$borrower", "value": accumulator}}
+            ]
+        )
+        found = {group["_id"]: group["value"] for group in groups}
+        for borrower in borrowers:
+            borrower[key] = found.get(borrower["_id"], default)
+        return borrowers
 
-    def delete_book(self, objectid):
+    def delete_borrower(self, objectid):
         """
-        Delete a book with a matching objectid
+        Delete a borrower with a matching objectid
 
         Example
         -------
 
-            >>> book_id = client.find_books(
-                name = "Trump",
-                exact = False,
-                insensitive = False
-            )[0]
             >>> client.delete_book(book_id)
 
         Parameters
         ----------
         objectid : bson.objectid.ObjectId
-            BSON ObjectId of book
+            BSON ObjectId of borrower
 
         Raises
         ------
@@ -952,324 +3922,456 @@ class Library:
         Returns
         -------
         info : None or dict
-            Info about deleted book or None if book not found
+            Info about deleted borrower or None if borrower not found
         """
         if type(objectid) != bson.objectid.ObjectId:
             raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
-        return self._books.find_one_and_delete({"_id": objectid})
+        self._invalidate("borrower", objectid)
+        return self._borrowers.find_one_and_delete({"_id": objectid})
 
-    # BORROWERS #
+    # LOANS #
 
-    def get_borrower(self, objectid):
+    def add_loan(self, book, borrower, begin_date, end_date, verify=False, quota=None):
         """
-        Get details of borrower with just objectid
+        Check out a book
+
+        Notes
+        -----
+        A slot of the borrower's quota is reserved first with one conditional update that only increments open_loans while it is below the quota, so concurrent checkouts cannot overshoot it. Borrowers without the counter get it rebuilt from their loans first. A copy of the book is then claimed with one conditional decrement of available_copies that only succeeds while a copy is left, pushing the ObjectId of the new loan onto current_loans, and the loan is inserted. Each step is undone if a later one fails. Concurrent checkouts of a title therefore never lend out more copies than it has, without reading the loans collection. Books that predate copy tracking are repaired from their loans first.
 
         Example
         -------
 
-            >>> details = client.get_borrower(
-                bson.objectid.ObjectId("507f191e810c19729de860ea")
+            >>> loan = client.add_loan(
+                book = ObjectId("5f0346e5dc308a044f7d4baf"),
+                borrower = ObjectId("5f093da5a893e6381d402bb4"),
+                begin_date = datetime.datetime.utcnow(),
+                end_date = datetime.datetime.utcnow() + datetime.timedelta(day=7)
+            )
+            >>> print(loan)
+            ObjectId('...')
+
+        Parameters
+        ----------
+        book : bson.objectid.ObjectId
+            BSON ObjectId of book
+
+        borrower : bson.objectid.ObjectId
+            BSON ObjectId of borrower
+
+        begin_date : datetime.datetime or dict of int
+            Date and time of borrowing
+
+        end_date : datetime.datetime or dict of int
+            Date and time of end of loan
+
+        verify : bool
+            Whether to raise ValueError for a book or borrower that does not exist instead of returning None, at the cost of two extra round trips
+
+        quota : None or int
+            Most books the borrower may hold at once. The quota from librarium.Library.get_meta if None
+
+        Raises
+        ------
+        TypeError
+            If data type of each parameter is not correct
+
+        librarium.QuotaError
+            If the borrower already holds quota books
+
+        ValueError
+            If quota is None and the library metadata has no quota, or verify is True and book or borrower does not exist
+
+        Return
+        ------
+        None or bson.objectid.ObjectId
+            BSON ObjectId of loan, or None if book or borrower does not exist or book had not been returned yet
+        """
+        if type(book) != bson.objectid.ObjectId:
+            raise TypeError(f"book is not a BSON ObjectId: {book}")
+        if type(borrower) != bson.objectid.ObjectId:
+            raise TypeError(f"borrower is not a BSON ObjectId: {borrower}")
+        if verify:
+            if not self.book_exists(book):
+                raise ValueError(f"book does not exist")
+            if not self.borrower_exists(borrower):
+                raise ValueError(f"borrower does not exist")
+        if type(begin_date) == dict:
+            start = {}
+            start = datetime.datetime(
+                year = begin_date["year"],
+                month = begin_date["month"],
+                day = begin_date["day"]
+            )
+        elif type(begin_date) == datetime.datetime:
+            start = begin_date
+        else:
+            raise TypeError(
+                f"start is not a datetime.datetime nor a dictionary representing a date: {begin_date}"
+            )
+        if type(end_date) == dict:
+            end = {}
+            end = datetime.datetime(
+                year = end_date["year"],
+                month = end_date["month"],
+                day = end_date["day"]
+            )
+        elif type(end_date) == datetime.datetime:
+            end = end_date
+        else:
+            raise TypeError(
+                f"end is not a datetime.datetime nor a dictionary representing a date: {end_date}"
             )
+        loan_id = bson.objectid.ObjectId()
+        document = {
+            "_id": loan_id,
+            "book": book,
+            "borrower": borrower,
+            "begin_date": start,
+            "end_date": end,
+            "returned": False
+        }
+        if quota == None:
+            meta = self.get_meta()
+            if meta == None or "quota" not in meta:
+                raise ValueError("library metadata has no quota, pass quota instead")
+            quota = meta["quota"]
+        if not self._reserve_quota(borrower, quota):
+            return None
+        self._invalidate("borrower", borrower)
+        try:
+            claimed = self._claim_copy(book, loan_id)
+        except Exception:
+            self._release_quota(borrower)
+            raise
+        if not claimed:
+            self._release_quota(borrower)
+            return None
+        try:
+            self._loans.insert_one(document)
+        except pymongo.errors.DuplicateKeyError:
+            # The librarium_open_loan_book index of older catalogues is still in place
+            self._release_quota(borrower)
+            self._release_copy(book, loan_id)
+            return None
+        except Exception:
+            self._release_quota(borrower)
+            self._release_copy(book, loan_id)
+            raise
+        return loan_id
+
+    def _claim_copy(self, book, loan):
+        """
+        Take a copy of a book for a loan if one is left.
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId
-            BSON ObjectId of borrower
+        book : bson.objectid.ObjectId
+            BSON ObjectId of book
 
-        Raises
-        ------
-        TypeError
-            If objectid is not a BSON ObjectId
+        loan : bson.objectid.ObjectId
+            BSON ObjectId of the loan taking the copy
 
         Returns
         -------
-        details : None or dict
-            Details of the borrower. None if borrower not found
+        claimed : bool
+            False if the book does not exist or has no copy left
         """
-        if type(objectid) != bson.objectid.ObjectId:
-            raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
-        details = self._borrowers.find_one({"_id": objectid})
-        details["loans"] = self.search_loans(
-            borrower = objectid,
-            returned = False
-        )
-        return details
+        for attempt in range(2):
+            claimed = self._books.update_one(
+                {"_id": book, "available_copies": {"$gt": 0}},
+                {
+                    "$inc": {"available_copies": -1},
+                    "$push": {"current_loans": loan}
+                }
+            )
+            if claimed.matched_count == 1:
+                self._invalidate("book", book)
+                return True
+            legacy = self._books.find_one(
+                {"_id": book, "available_copies": {"$exists": False}},
+                {"_id": 1}
+            )
+            if legacy == None:
+                return False
+            # A book added before copies were counted
+            self.repair_availability([book])
+        return False
 
-    def find_borrowers(self, username, exact=True, insensitive=False):
+    def _release_copy(self, book, loan):
         """
-        Find borrower(s) with username.
+        Give back the copy of a book held by a loan.
 
-        Example
-        -------
+        Parameters
+        ----------
+        book : bson.objectid.ObjectId
+            BSON ObjectId of book
 
-        >>> client.find_borrower(
-            username = "timmytom"
+        loan : bson.objectid.ObjectId
+            BSON ObjectId of the loan holding the copy
+        """
+        released = self._books.update_one(
+            {"_id": book, "current_loans": loan},
+            {
+                "$inc": {"available_copies": 1},
+                "$pull": {"current_loans": loan}
+            }
         )
-        ObjectId(...)
+        if released.matched_count == 0:
+            # A loan made before copies were counted
+            self.repair_availability([book])
+        self._invalidate("book", book)
+
+    def _reserve_quota(self, borrower, quota):
+        """
+        Count a new loan against a borrower's quota if it has room.
 
         Parameters
         ----------
-        username : str
-            Username of the borrower
-
-        exact : bool
-            Whether to search exact name or as regular expression
+        borrower : bson.objectid.ObjectId
+            BSON ObjectId of borrower
 
-        insensitive : bool
-            Case insensitivity
+        quota : int
+            Most books the borrower may hold at once
 
         Raises
         ------
-        AttributiveError
-            If borrower collection not connected yet
-
-        TypeError
-            If name is not a string or capital is not a boolean
+        librarium.QuotaError
+            If the borrower already holds quota books
 
         Returns
         -------
-        borrower_ids : list of bson.objectid.ObjectId
-            ObjectIds of borrowers with the requested name
-        """
-        if type(username) != str:
-            raise TypeError(f"username is not a string: {name}")
-        term = username
-        query = {"username": {"$regex": None, "$options": ""}}
-        if exact:
-            term = "^" + username
-        query["username"]["$regex"] = term
-        if insensitive:
-            query["username"]["$options"] += "i"
-        borrowers = list(self._borrowers.find(query))
-        borrower_ids = [x["_id"] for x in borrowers]
-        return borrower_ids
-
-    def borrower_exists(self, objectid):
+        reserved : bool
+            False if the borrower does not exist
         """
-        Check if borrower exists with ObjectId.
-
-        Example
-        -------
-
-            >>> client.borrower_exists(
-                bson.objectid.ObjectId(
-                    "5f019ed2ffd6b60fae41212f"
-                )
+        for attempt in range(2):
+            reserved = self._borrowers.update_one(
+                {"_id": borrower, "open_loans": {"$lt": quota}},
+                {"$inc": {"open_loans": 1}}
             )
+            if reserved.matched_count == 1:
+                return True
+            details = self._borrowers.find_one({"_id": borrower}, {"open_loans": 1})
+            if details == None:
+                return False
+            if "open_loans" in details:
+                break
+            # A borrower added before open loans were counted
+            self.repair_open_loans([borrower])
+        raise QuotaError(f"borrower has reached the quota of {quota} loans")
+
+    def _release_quota(self, borrower):
+        """
+        Take a loan off a borrower's open_loans counter.
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId or None
-            Borrower objectid
-
-        Raises
-        ------
-        TypeError
-            If objectid is not a BSON ObjectId
-
-        Returns
-        -------
-        exists : bool
-            Whether borrower exists
+        borrower : bson.objectid.ObjectId
+            BSON ObjectId of borrower
         """
-        if objectid == [] or objectid == None:
-            return False
-        if type(objectid) != bson.objectid.ObjectId:
-            raise TypeError("objectid is not a BSON ObjectId")
-        borrower = self._borrowers.find_one(
-            {"_id": objectid}
+        self._borrowers.update_one(
+            {"_id": borrower, "open_loans": {"$gt": 0}},
+            {"$inc": {"open_loans": -1}}
         )
-        return borrower != None
+        self._invalidate("borrower", borrower)
 
-    def add_borrower(self, username, password, name, phone, email, address):
+    def repair_availability(self, books=None):
         """
-        Add a borrower into collection.
+        Rebuild the copy counts and current_loans of books from their open loans.
 
         Notes
+        -----
+        Run this once on a library whose books predate copy tracking, and after any crash in the middle of librarium.Library.add_loan or librarium.Library.return_loan. Open loans are grouped in one aggregation, books are read back with a projection and the ones that are wrong are fixed with unordered bulk writes. Books without copies are given one. A checkout running at the same time as the repair may be undone by it, so run it while checkouts are quiet.
 
         Example
         -------
 
-            >>> id = client.add_borrower(
-                username = "timtam-chocolates",
-                password = "youwontguessthisxd",
-                name = "Tim Tom",
-                phone = "999"
-                email = "fake_email@liame.com",
-                address = "123 Tuas Link S147258",
-                skip = False
-            )
-            >>> print(id)
-            ObjectId('...')
+            >>> client.repair_availability()
+            3
 
         Parameters
         ----------
-        username : str
-            Username of the borrower
-
-        password : str
-            Password used to
-
-        name : str
-            Real life name of the borrower
-
-        phone : str
-            Phone number of borrower. Can have separation marks
-
-        email : str
-            Email of the borrower
-
-        address : str
-            Home address of the borrower
+        books : None or list of bson.objectid.ObjectId
+            Books to repair. Every book if None
 
         Raises
         ------
-        AttributeError
-            If borrower collection not connected to yet
-
         TypeError
-            If any of the parameters given are not correct in their data type
-
-        ValueError
-            If borrower with the same username found
+            If books is not a list of BSON ObjectIds
 
         Returns
         -------
-        borrower.inserted_id : bson.objectid.ObjectId
-            ObjectId of the borrower added to the collection
+        count : int
+            Number of books whose availability was changed
         """
-        found = self.find_borrowers(username,True,False)
-        if found != []:
-            raise ValueError(
-                f"borrower with the same username found: {username}"
+        match = {"returned": False}
+        scope = {}
+        if books != None:
+            if (type(books) != list or
+                any(type(x) != bson.objectid.ObjectId for x in books)):
+                raise TypeError(f"books is not a list of BSON ObjectIds: {books}")
+            match["book"] = {"$in": books}
+            scope = {"_id": {"$in": books}}
+        current = {
+            x["_id"]: x["loans"] for x in self._loans.aggregate(
+                [
+                    {"$match": match},
+                    {"$sort": {"begin_date": 1}},
+                    {"$group": {"_id": "$book", "loans": {"$push": "$_id"}}}
+                ]
             )
-        if type(username) != str:
-            raise TypeError("username is not a string")
-        if type(password) != str:
-            raise TypeError("password is not a string")
-        if type(name) != str:
-            raise TypeError("name is not a string")
-        if type(phone) != str:
-            raise TypeError("phone is not a string")
-        if type(email) != str:
-            raise TypeError("email is not a string")
-        if type(address) != str:
-            raise TypeError("address is not a string")
-        document = {
-            "username": username,
-            "password": password,
-            "name": name,
-            "phone": phone,
-            "email": email,
-            "address": address,
-            "last_updated": datetime.datetime.utcnow()
         }
-        return self._borrowers.insert_one(document).inserted_id
-
-    def update_borrower(self, objectid, **kwargs):
+        count = 0
+        operations = []
+        cursor = self._books.find(
+            scope,
+            {
+                "copies": 1,
+                "available_copies": 1,
+                "available": 1,
+                "current_loans": 1,
+                "current_loan": 1
+            }
+        )
+        for details in cursor:
+            loans = current.get(details["_id"], [])
+            copies = details.get("copies", 1)
+            expected = {
+                "copies": copies,
+                "available_copies": max(copies - len(loans), 0),
+                "current_loans": loans
+            }
+            if ("current_loan" not in details and "available" not in details and
+                all(details.get(k) == v for k, v in expected.items())):
+                continue
+            operations.append(
+                pymongo.UpdateOne(
+                    {"_id": details["_id"]},
+                    {"$set": expected, "$unset": {"current_loan": "", "available": ""}}
+                )
+            )
+            if len(operations) >= 1000:
+                count += self._books.bulk_write(operations, ordered=False).modified_count
+                operations = []
+        if operations != []:
+            count += self._books.bulk_write(operations, ordered=False).modified_count
+        if self._cache != None:
+            self.clear_cache()
+        return count
+
+    def repair_open_loans(self, borrowers=None):
         """
-        Update a borrower in the collection
+        Rebuild the open_loans counter of borrowers from their open loans.
+
+        Notes
+        -----
+        Run this once on a library whose borrowers predate the counter, although librarium.Library.add_loan also repairs such borrowers as they check out, and after any crash in the middle of librarium.Library.add_loan. Open loans are counted in one aggregation and the borrowers are fixed with one unordered bulk write. Borrowers whose counter is already right are not written.
 
         Example
         -------
 
-            >>> id = client.add_borrower(
-                username = "yamai",
-                password = "password",
-                name = "Josg Michael Tmg",
-                phone = "999",
-                address = "123 Tuas Link S147258"
-                email = "creative.name@coolmail.biz.su"
-            )
-            >>> client.update_borrower(
-                objectid = id,
-                name = "Josh Michael Tng"
-            )
+            >>> client.repair_open_loans()
+            2
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId
-            ObjectId of wanted borrower
-
-        **kwargs : dict
-            password : str
-                Password used to
-            name : str
-                Real life name of the borrower
-            phone : str
-                Phone number of the borrower
-            email : str
-                Email of the borrower
-            address : str
-                Home address of the borrower
+        borrowers : None or list of bson.objectid.ObjectId
+            Borrowers to repair. Every borrower if None
 
         Raises
         ------
         TypeError
-            If type of kwargs parameters are not the correct type
+            If borrowers is not a list of BSON ObjectIds
 
-        ValueError
-            If email is not a valid email
+        Returns
+        -------
+        count : int
+            Number of borrowers whose counter was changed
         """
-        if type(objectid) != bson.objectid.ObjectId:
-            raise TypeError("objectid is not a BSON ObjectId")
-        keywords = [
-            "password",
-            "name",
-            "phone",
-            "email",
-            "address"
-        ]
-        document = {}
-        for key, value in kwargs.items():
-            if key not in keywords:
-                continue
-            if type(value) != str:
+        match = {"returned": False}
+        scope = {}
+        if borrowers != None:
+            if (type(borrowers) != list or
+                any(type(x) != bson.objectid.ObjectId for x in borrowers)):
                 raise TypeError(
-                    f"{value} associated with {key} is not a string"
+                    f"borrowers is not a list of BSON ObjectIds: {borrowers}"
                 )
-            document[key] = value
-        document["last_updated"] = datetime.datetime.utcnow()
-        self._borrowers.update_one(
-            {"_id": objectid},
-            {"$set": document}
+            match["borrower"] = {"$in": borrowers}
+            scope = {"_id": {"$in": borrowers}}
+        counts = {
+            x["_id"]: x["count"] for x in self._loans.aggregate(
+                [
+                    {"$match": match},
+                    {"$group": {"_id": "$borrower", "count": {"$sum": 1}}}
+                ]
+            )
+        }
+        operations = [
+            pymongo.UpdateOne(
+                {"_id": borrower, "open_loans": {"$ne": count}},
+                {"$set": {"open_loans": count}}
+            )
+            for borrower, count in counts.items()
+        ]
+        operations.append(
+            pymongo.UpdateMany(
+                {
+                    "$and": [
+                        scope,
+                        {"_id": {"$nin": list(counts)}},
+                        {"open_loans": {"$ne": 0}}
+                    ]
+                },
+                {"$set": {"open_loans": 0}}
+            )
         )
+        result = self._borrowers.bulk_write(operations, ordered=False)
+        if self._cache != None:
+            self.clear_cache()
+        return result.modified_count
 
-    def add_borrowers(self, borrowers, update=False):
+    def search_loans(self, sort=[], fields=None, expand=None, **terms):
         """
-        Add multiple books to collection.
+        Search loans with terms.
+
+        Notes
+        -----
+        With expand, the book and borrower of each loan are joined with $lookup in the same aggregation and embedded under "book_data" and "borrower_data", holding only the fields asked for. A loan whose book or borrower no longer exists gets an empty document.
 
         Example
         -------
 
-            >>> borrowers = [
-                {
-                    username = "timtam-chocolates",
-                    password = "youwontguessthisxd",
-                    name = "Tim Tom",
-                    phone = "999",
-                    email = "fake_email@liame.com",
-                    address = "123 Tuas Link S147258"
-                },
-                {
-                    username = "yamai",
-                    password = "password",
-                    name = "Josh Michael Tng",
-                    phone = "743978932",
-                    address = "123 Tuas Link S147258"
-                    email = "creative.name@coolmail.biz"
-                }
-            ]
-            >>> print(borrowers, update=False)
-            [ObjectId('...'),ObjectId('...')]
+            >>> info = client.search_loans(
+                sort = [("end_date", -1)]
+                end_date = {"$gte": datetime.datetime(2019,12,31)}
+            )
+            >>> print(info)
+            [{data}]
+
+            >>> info = client.search_loans(
+                expand = {"book": ["name"]},
+                borrower = ObjectId("5f093da5a893e6381d402bb4"),
+                returned = False
+            )
+            >>> print(info[0]["book_data"]["name"])
+            Dune
 
         Parameters
         ----------
-        borrowers : list of dict of str
-            List of borrowers with parameters to be inputted into the system. Available parameters are listed in self.add_borrower()
+        sort : list of tuple of str, int
 
-        update : bool
-            Whether to update if the borrower with the same username is found
+        fields : None or list of str
+            Fields of each loan to return, _id always included. Every field if None
+
+        expand : None, list of str or dict of str, list of str
+            "book" and/or "borrower" to embed with the fields in librarium.EXPAND_FIELDS, or a dictionary of the fields to embed for each
+
+        **terms : dict
+            book : bson.objectid.ObjectId
+            borrower : bson.objectid.ObjectId
+            begin_date : dict of str, datetime.datetime
+            end_date : dict of str, datetime.datetime
+            returned : bool
 
         Raises
         ------
@@ -1280,360 +4382,421 @@ class Library:
             If mandatory keys are missing
 
         TypeError
-            If any of the parameters given are not correct in their data type or name is missing
+            If any of the parameters given are not correct in their data type or **terms is missing
 
         ValueError
-            If erroneous date inputted
+            If erroneous date inputted or expand names something other than "book" or "borrower"
 
         Returns
         -------
-        borrower_ids : list of bson.objectid.ObjectId
-            List of ObjectIds of the borrowers added to the library.
+        list of dict
         """
-        if not update:
-            return [self.add_borrower(**borrower) for borrower in borrowers]
-        borrower_ids = []
-        for borrower in borrowers:
-            found = self.find_borrowers(borrower["username"], True, False)
-            if found == []:
-                borrower_ids.append(
-                    self.add_borrower(
-                        **borrower
-                    )
-                )
-            else:
-                self.update_borrower(
-                    objectid = found[0],
-                    **borrower
-                )
-                borrower_ids.append(found[0])
-        return borrower_ids
+        return list(self.iter_loans(sort, fields=fields, expand=expand, **terms))
 
-    def import_borrowers(self, filepath, update=False):
+    def iter_loans(self, sort=[], batch_size=None, fields=None, expand=None, **terms):
         """
-        Import borrowers from a JSON or BSON file.
-
-        Notes
-        -----
-        The JSON and BSON file should have an array as the first-level data.
+        Lazily search loans with terms.
 
         Example
         -------
 
-            >>> borrowers = client.import_borrowers(
-                filepath = pathlib.Path("borrowers.json"),
-                update = True
-            )
+            >>> for loan in client.iter_loans(returned = False):
+                    print(loan["end_date"])
 
         Parameters
         ----------
-        filepath : str or pathlib.Path
-            File path in string or pathlib.Path form (recommended)
+        sort : list of tuple of str, int
 
-        update : bool
-            Whether to update if the borrower if a borrower with the same name is found
+        batch_size : None or int
+            Number of loans fetched from the server per round trip. Server default if None
 
-        Raises
-        ------
-        FileNotFoundError
-            File with the requested name through the requested path not found
+        fields : None or list of str
+            Fields of each loan to return. Every field if None
 
-        TypeError
-            If filepath is not a string or pathlib.Path
+        expand : None, list of str or dict of str, list of str
+            Same as librarium.Library.search_loans
 
-        ValueError
-            If file is not a JSON or BSON file
+        **terms : dict
+            Same as librarium.Library.search_loans
 
-        Returns
-        -------
-        borrowers_id : list of bson.objectid.ObjectId
+        Yields
+        ------
+        dict
         """
-        decoder = ""
-        file = None
-        if type(filepath) == str:
-            if filepath.endswith(".json"):
-                decoder = "JSON"
-            elif filepath.endswith(".bson"):
-                decoder = "BSON"
-            else:
-                raise ValueError("file is not a JSON or BSON file")
-        elif type(filepath) == pathlib.Path:
-            if filepath.suffix == ".json":
-                decoder = "JSON"
-            elif filepath.suffix == ".bson":
-                decoder = "BSON"
-            else:
-                raise ValueError("file is not a JSON or BSON file")
-        else:
-            raise TypeError("filepath is not a string or pathlib.Path")
-        if decoder == "JSON":
-            data = json.load(open(filepath, "r"))
-        elif decoder == "BSON":
-            data = bson.loads(open(filepath,"r").read())
-        return self.add_borrowers(data, update=update)
+        query = self._loans_query(**terms)
+        if expand != None:
+            cursor = self._loans.aggregate(
+                self._loan_pipeline(query, sort, fields, expand),
+                batchSize = batch_size
+            )
+            with cursor:
+                yield from cursor
+            return
+        cursor = self._loans.find(
+            query,
+            self._projection(fields),
+            batch_size = batch_size or 0
+        )
+        if sort != []:
+            cursor = cursor.sort(sort)
+        with cursor:
+            yield from cursor
 
-    def search_borrowers(self, sort=[], **terms):
+    def page_loans(self, after=None, limit=20, key="_id", direction=1, fields=None, **terms):
         """
-        Search books based on different available queries.
+        Get one page of a loan search with keyset pagination.
 
         Example
         -------
 
-            >>> info = client.search_books(
-                name = ["Josh"]
+            >>> loans, after = client.page_loans(
+                limit = 50,
+                key = "end_date",
+                returned = False
             )
-            >>> print(info)
-            [{data}]
 
         Parameters
         ----------
-        sort : list of tuple, int
-            How to sort items
+        after, limit, key, direction
+            Same as librarium.Library.page_books
+
+        fields : None or list of str
+            Fields of each loan to return. Every field if None. key is always returned
 
         **terms : dict
-            username : list of str
-            password : list of str
-            name : list of str
-            phone : list of str
-            email : list of str
-            address : list of str
+            Same as librarium.Library.search_loans
 
         Raises
         ------
-        AttributeError
-            If borrower collection not connected to yet
-
-        KeyError
-            If mandatory keys are missing
-
         TypeError
-            If any of the parameters given are not correct in their data type or **terms is missing
+            If after does not match key
 
         ValueError
-            If erroneous date inputted
+            If limit is smaller than 1 or direction is not 1 or -1
 
         Returns
         -------
-        list of dict
+        loans : list of dict
+
+        after : None, bson.objectid.ObjectId or tuple
+            What to pass as after for the next page. None if the page is short of limit, so there are no more pages
         """
-        trmkeys = list(terms.keys())
-        and_string = [
-            "username",
-            "password",
-            "name",
-            "phone",
-            "email",
-            "address"
-        ]
-        query = {"$and": []}
-        for item in and_string:
-            inner_query = {"$and": []}
-            if item not in trmkeys:
-                continue
-            if terms[item] == None:
-                continue
-            for term in terms[item]:
-                if term != "":
-                    inner_query["$and"].append(
-                        {item: {"$regex": term, "$options": "i"}}
-                    )
-            if inner_query != {"$and": []}:
-                query["$and"].append(inner_query)
-        if query == {"$and": []}:
-            query = {}
-        if sort == []:
-            borrowers = list(self._borrowers.find(query))
-        else:
-            borrowers = list(self._borrowers.find(query).sort(sort))
-        for borrower in range(len(borrowers)):
-            borrowers[borrower]["loans"] = self.search_loans(
-                borrower = borrowers[borrower]["_id"],
-                returned = False
-            )
-        return borrowers
+        query, sort = self._keyset(
+            self._loans_query(**terms), after, limit, key, direction
+        )
+        if fields != None and key not in fields:
+            fields = fields + [key]
+        loans = list(
+            self._loans.find(
+                query,
+                self._projection(fields)
+            ).sort(sort).limit(limit)
+        )
+        return loans, self._next_after(loans, limit, key)
 
-    def delete_borrower(self, objectid):
+    def count_loans(self, **terms):
         """
-        Delete a borrower with a matching objectid
+        Count loans matching search terms without fetching them.
 
         Example
         -------
 
-            >>> client.delete_book(book_id)
+            >>> client.count_loans(
+                returned = False
+            )
+            3
 
         Parameters
         ----------
-        objectid : bson.objectid.ObjectId
-            BSON ObjectId of borrower
-
-        Raises
-        ------
-        TypeError
-            objectid is not a BSON ObjectId
+        **terms : dict
+            Same as librarium.Library.search_loans
 
         Returns
         -------
-        info : None or dict
-            Info about deleted borrower or None if borrower not found
+        count : int
         """
-        if type(objectid) != bson.objectid.ObjectId:
-            raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
-        return self._borrowers.find_one_and_delete({"_id": objectid})
+        return self._loans.count_documents(self._loans_query(**terms))
 
-    # LOANS #
-
-    def add_loan(self, book, borrower, begin_date, end_date):
+    def overdue_loans(self, as_of=None, sort=[("days_overdue", -1)], limit=0):
         """
-        Check out a book
+        Report open loans past their end date with the book and borrower they belong to.
+
+        Notes
+        -----
+        The whole report is one aggregation. Open loans ending before as_of are matched through the librarium_returned_end_date index, the book name and borrower username and email are joined with $lookup, and the whole days overdue are computed on the server. When sorting only by days_overdue or loan fields, the sort and limit run before the joins, so only the loans returned are joined.
 
         Example
         -------
 
-            >>> loan = client.add_loan(
-                book = ObjectId("5f0346e5dc308a044f7d4baf"),
-                borrower = ObjectId("5f093da5a893e6381d402bb4"),
-                begin_date = datetime.datetime.utcnow(),
-                end_date = datetime.datetime.utcnow() + datetime.timedelta(day=7)
-            )
-            >>> print(loan)
-            ObjectId('...')
+            >>> client.overdue_loans(limit = 2)
+            [{'_id': ObjectId('...'), 'book': ObjectId('...'), 'borrower': ObjectId('...'), 'begin_date': datetime.datetime(...), 'end_date': datetime.datetime(...), 'book_name': 'Dune', 'username': 'timmytom', 'email': 'timmytom@example.com', 'days_overdue': 12}, ...]
 
         Parameters
         ----------
-        book : bson.objectid.ObjectId
-            BSON ObjectId of book
+        as_of : None or datetime.datetime
+            Moment loans are overdue at. Now if None
 
-        borrower : bson.objectid.ObjectId
-            BSON ObjectId of borrower
+        sort : list of tuple of str, int
+            How to sort the report. Keys may be days_overdue, book_name, username, email or any loan field
 
-        begin_date : datetime.datetime or dict of int
-            Date and time of borrowing
+        limit : int
+            Maximum number of loans to return. No limit if 0
 
-        end_date : datetime.datetime or dict of int
-            Date and time of end of loan
+        Raises
+        ------
+        TypeError
+            If as_of is not a datetime.datetime
+
+        Returns
+        -------
+        loans : list of dict
+            _id, book, borrower, begin_date and end_date of each loan with book_name, username, email and days_overdue
+        """
+        if as_of == None:
+            as_of = datetime.datetime.utcnow()
+        if type(as_of) != datetime.datetime:
+            raise TypeError(f"as_of is not a datetime.datetime: {as_of}")
+        pipeline = [{"$match": {"returned": False, "end_date": {"$lt": as_of}}}]
+        early = []
+        for key, direction in sort:
+            if key in ["book_name", "username", "email"]:
+                early = None
+                break
+            if key == "days_overdue":
+                early.append(("end_date", -direction))
+            else:
+                early.append((key, direction))
+        if early != None:
+            if early != []:
+                pipeline.append({"$sort": bson.son.SON(early)})
+            if limit != 0:
+                pipeline.append({"$limit": limit})
+        pipeline += [
+            self._lookup(self._books, "book", "book_data"),
+            self._lookup(self._borrowers, "borrower", "borrower_data"),
+            {
+                "$project": {
+                    "book": 1,
+                    "borrower": 1,
+                    "begin_date": 1,
+                    "end_date": 1,
+                    "book_name": self._first("book_data", "name"),
+                    "username": self._first("borrower_data", "username"),
+                    "email": self._first("borrower_data", "email"),
+                    "days_overdue": {
+                        "$floor": {
+                            "$divide": [
+                                {"$subtract": [as_of, "$end_date"]},
+                                86400000
+                            ]
+                        }
+                    }
+                }
+            }
+        ]
+        if early == None:
+            pipeline.append({"$sort": bson.son.SON(sort)})
+            if limit != 0:
+                pipeline.append({"$limit": limit})
+        return list(self._loans.aggregate(pipeline))
+
+    def _loan_pipeline(self, query, sort=[], fields=None, expand=None):
+        """
+        Build an aggregation pipeline that finds loans and embeds their book and borrower.
+
+        Parameters
+        ----------
+        query : dict
+            MongoDB query used to match loans
+
+        sort, fields, expand
+            Same as librarium.Library.search_loans
 
         Raises
         ------
         TypeError
-            If data type of each parameter is not correct
+            If expand or its fields are not of the accepted types
 
         ValueError
-            If book or borrower does not exist
+            If expand names something other than "book" or "borrower"
 
-        Return
-        ------
-        None or bson.objectid.ObjectId
-            BSON ObjectId of loan, or None if book had not been returned yet
+        Returns
+        -------
+        pipeline : list of dict
         """
-        if type(book) != bson.objectid.ObjectId:
-            raise TypeError(f"book is not a BSON ObjectId: {book}")
-        if self.book_borrowed(book):
-            return None
-        if not self.book_exists(book):
-            raise ValueError(f"book does not exist")
-        if type(borrower) != bson.objectid.ObjectId:
-            raise TypeError(f"book is not a BSON ObjectId: {borrower}")
-        if not self.borrower_exists(borrower):
-            raise ValueError(f"borrower does not exist")
-        if type(begin_date) == dict:
-            start = {}
-            start = datetime.datetime(
-                year = begin_date["year"],
-                month = begin_date["month"],
-                day = begin_date["day"]
-            )
-        elif type(begin_date) == datetime.datetime:
-            start = begin_date
-        else:
-            raise TypeError(
-                f"start is not a datetime.datetime nor a dictionary representing a date: {begin_date}"
-            )
-        if type(end_date) == dict:
-            end = {}
-            end = datetime.datetime(
-                year = end_date["year"],
-                month = end_date["month"],
-                day = end_date["day"]
-            )
-        elif type(end_date) == datetime.datetime:
-            end = end_date
-        else:
-            raise TypeError(
-                f"end is not a datetime.datetime nor a dictionary representing a date: {end_date}"
-            )
-        document = {
-            "book": book,
-            "borrower": borrower,
-            "begin_date": start,
-            "end_date": end,
-            "returned": False
+        if type(expand) == list:
+            expand = {kind: EXPAND_FIELDS.get(kind) for kind in expand}
+        if type(expand) != dict:
+            raise TypeError(f"expand is not a list or dictionary: {expand}")
+        sources = {"book": self._books, "borrower": self._borrowers}
+        pipeline = [{"$match": query}]
+        if sort != []:
+            pipeline.append({"$sort": bson.son.SON(sort)})
+        embedded = {}
+        for kind, wanted in expand.items():
+            if kind not in sources:
+                raise ValueError(f"expand is not 'book' or 'borrower': {kind}")
+            if type(wanted) != list or any(type(x) != str for x in wanted):
+                raise TypeError(f"fields to expand are not a list of strings: {wanted}")
+            as_field = kind + "_data"
+            pipeline.append(self._lookup(sources[kind], kind, as_field))
+            # A plain nested document would be merged into the joined ones, keeping all their fields
+            embedded[as_field] = {
+                "$mergeObjects": [
+                    {field: self._first(as_field, field) for field in wanted}
+                ]
+            }
+        pipeline.append({"$addFields": embedded})
+        if fields != None:
+            projection = self._projection(fields)
+            projection.update({as_field: 1 for as_field in embedded})
+            pipeline.append({"$project": projection})
+        return pipeline
+
+    def _lookup(self, collection, local_field, as_field):
+        """
+        Build a $lookup stage joining the document a loan refers to.
+
+        Parameters
+        ----------
+        collection : pymongo.Collection
+            Collection holding the referred documents
+
+        local_field : str
+            Field of the loan holding the ObjectId
+
+        as_field : str
+            Field the joined documents are put in, as an array
+
+        Returns
+        -------
+        stage : dict
+        """
+        return {
+            "$lookup": {
+                "from": collection.name,
+                "localField": local_field,
+                "foreignField": "_id",
+                "as": as_field
+            }
         }
-        return self._loans.insert_one(document).inserted_id
 
-    def search_loans(self, sort=[], **terms):
+    def _first(self, as_field, field):
+        """
+        Build an expression picking one field of the document joined by librarium.Library._lookup.
+
+        Parameters
+        ----------
+        as_field : str
+            Field holding the joined documents
+
+        field : str
+            Field of the joined document
+
+        Returns
+        -------
+        expression : dict
+            Missing if nothing was joined
+        """
+        return {"$arrayElemAt": [f"${as_field}.{field}", 0]}
+
+    def _loans_query(self, **terms):
+        """
+        Build the MongoDB query for a loan search.
+
+        Parameters
+        ----------
+        **terms : dict
+            Same as librarium.Library.search_loans
+
+        Returns
+        -------
+        query : dict
+        """
+        trmkeys = list(terms.keys())
+        and_items = ["book", "borrower", "begin_date", "end_date", "returned"]
+        query = {"$and": []}
+        for item in and_items:
+            if item not in trmkeys:
+                continue
+            if terms[item] == None:
+                continue
+            if terms[item] != "" and terms[item] != {}:
+                query["$and"].append({item: terms[item]})
+        if query == {"$and": []}:
+            query = {}
+        return query
+
+    def export_loans(self, filepath, format=None, compression=None, batch_size=1000, query=None, fields=None):
         """
-        Search loans with terms.
+        Export loans to a JSON Lines, BSON or CSV file.
+
+        Notes
+        -----
+        Streamed to the file by librarium.Library._export, whose notes cover memory use and BSON output.
 
         Example
         -------
 
-            >>> info = client.search_loans(
-                sort = [("end_date", -1)]
-                end_date = {"$gte": datetime.datetime(2019,12,31)}
+            >>> count = client.export_loans(
+                filepath = pathlib.Path("loans.csv")
             )
-            >>> print(info)
-            [{data}]
 
         Parameters
         ----------
-        sort : list of tuple of str, int
+        filepath : str or pathlib.Path
+            File path in string or pathlib.Path form (recommended)
 
-        **terms : dict
-            book : bson.objectid.ObjectId
-            borrower : bson.objectid.ObjectId
-            begin_date : dict of str, datetime.datetime
-            end_date : dict of str, datetime.datetime
-            returned : bool
+        format : None, "jsonl", "bson" or "csv"
+            Format of the file. Worked out from the suffix of filepath (.jsonl, .ndjson, .bson or .csv) if None
+
+        compression : None, "none", "gzip" or "zstd"
+            Compression of the file. Worked out from the suffix of filepath (.gz or .zst) if None. zstd requires the zstandard package
+
+        batch_size : int
+            Number of documents fetched from the server per round trip
+
+        query : None or dict
+            MongoDB query selecting the documents to export. Every document if None
+
+        fields : None or list of str
+            Fields to export. Every field if None, or the columns in librarium.CSV_FIELDS for CSV
 
         Raises
         ------
-        AttributeError
-            If borrower collection not connected to yet
-
-        KeyError
-            If mandatory keys are missing
+        ImportError
+            If zstd compression is requested but zstandard is not installed
 
         TypeError
-            If any of the parameters given are not correct in their data type or **terms is missing
+            If filepath is not a string or pathlib.Path
 
         ValueError
-            If erroneous date inputted
+            If the format or compression is unknown or cannot be worked out from filepath
 
         Returns
         -------
-        list of dict
+        count : int
+            Number of documents written
         """
-        trmkeys = list(terms.keys())
-        and_items = ["book", "borrower", "begin_date", "end_date", "returned"]
-        query = {"$and": []}
-        for item in and_items:
-            if item not in trmkeys:
-                continue
-            if terms[item] == None:
-                continue
-            if terms[item] != "" and terms[item] != {}:
-                query["$and"].append({item: terms[item]})
-        if query == {"$and": []}:
-            query = {}
-        if sort == []:
-            return list(self._loans.find(query))
-        else:
-            return list(self._loans.find(query).sort(sort))
+        return self._export(
+            self._loans,
+            "loans",
+            filepath,
+            format,
+            compression,
+            batch_size,
+            query,
+            fields
+        )
 
     def return_loan(self, objectid):
         """
         Return a book with objectid of loan
 
+        Notes
+        -----
+        The loan is marked as returned with a single conditional update, so returning the same loan twice is detected atomically. The book's copy is then given back with one conditional increment of available_copies, and the borrower's open_loans counter is decremented.
+
         Example
         -------
 
@@ -1654,38 +4817,76 @@ class Library:
             If objectid is not a BSON ObjectId
 
         ValueError
-            If loan does not exist
+            If loan does not exist or has already been returned
 
         Returns
         -------
         details : dict
-            Dictionary of details of loan
+            Dictionary of details of loan, including when it was returned
         """
         if type(objectid) != bson.objectid.ObjectId:
             raise TypeError(f"objectid is not a BSON ObjectId: {objectid}")
-        loan = self._loans.find_one({"_id": objectid})
-        if loan == None:
-            raise ValueError(f"loan with objectid not found: {objectid}")
-        self._loans.update_one(
-            {"_id": objectid},
-            {"$set":{"returned": True}}
+        now = datetime.datetime.utcnow()
+        details = self._loans.find_one_and_update(
+            {"_id": objectid, "returned": False},
+            {"$set": {"returned": True, "returned_date": now}},
+            return_document = pymongo.ReturnDocument.AFTER
         )
-        details = self._loans.find_one({"_id": objectid})
-        details["late"] = (datetime.datetime.utcnow() > details["end_date"])
+        if details == None:
+            if self._loans.find_one({"_id": objectid}, {"_id": 1}) == None:
+                raise ValueError(f"loan with objectid not found: {objectid}")
+            raise ValueError(f"loan has already been returned: {objectid}")
+        self._release_copy(details["book"], objectid)
+        self._release_quota(details["borrower"])
+        details["late"] = (now > details["end_date"])
         return details
 
     # LIBRARY METADATA
 
-    def get_meta(self):
+    def get_meta(self, max_age=300):
         """
         Get metadata about library. Metadata includes maximum items borrowable (quota) and days per book allowed (period)
 
+        Notes
+        -----
+        Metadata rarely changes, so a cached copy is returned unless it is older than max_age seconds. While librarium.Library.watch_meta is running the cached copy is kept current by a change stream and max_age is ignored.
+
         Example
         -------
 
             >>> print(client.get_meta())
             {"quota": 16, "period": 14}
 
+        Parameters
+        ----------
+        max_age : int or float
+            Oldest cached copy in seconds that may be returned. 0 always fetches from the library collection
+
+        Raises
+        ------
+        AttributeError
+            If library collection not connected yet
+
+        Returns
+        -------
+        dict
+        """
+        watching = self._meta_watcher != None and self._meta_watcher.is_alive()
+        if (self._meta == None or
+            (not watching and time.monotonic() - self._meta_fetched >= max_age)):
+            return self.refresh_meta()
+        return copy.deepcopy(self._meta)
+
+    def refresh_meta(self):
+        """
+        Fetch library metadata again, replacing the cached copy.
+
+        Example
+        -------
+
+            >>> client.refresh_meta()
+            {"quota": 16, "period": 14}
+
         Raises
         ------
         AttributeError
@@ -1695,4 +4896,518 @@ class Library:
         -------
         dict
         """
-        return self._library.find_one({})
+        self._meta = self._library.find_one({})
+        self._meta_fetched = time.monotonic()
+        return copy.deepcopy(self._meta)
+
+    def watch_meta(self):
+        """
+        Keep the cached library metadata current with a change stream on the library collection.
+
+        Notes
+        -----
+        A daemon thread refetches the metadata whenever the library collection changes. Change streams need a replica set or sharded cluster, such as MongoDB Atlas. If the stream fails, the thread stops and get_meta falls back to its max_age.
+
+        Example
+        -------
+
+            >>> client.watch_meta()
+
+        Raises
+        ------
+        OperationFailure
+            If the server does not support change streams
+
+        Returns
+        -------
+        self : librarium.Library
+        """
+        if self._meta_watcher != None and self._meta_watcher.is_alive():
+            return self
+        stream = self._library.watch()
+        self.refresh_meta()
+
+        def watch():
+            try:
+                for _ in stream:
+                    self.refresh_meta()
+            except pymongo.errors.PyMongoError:
+                pass
+            finally:
+                stream.close()
+
+        self._meta_stream = stream
+        self._meta_watcher = threading.Thread(
+            target = watch,
+            name = "librarium-meta-watcher",
+            daemon = True
+        )
+        self._meta_watcher.start()
+        return self
+
+    def unwatch_meta(self):
+        """
+        Stop the change stream started by librarium.Library.watch_meta.
+
+        Returns
+        -------
+        self : librarium.Library
+        """
+        if self._meta_stream != None:
+            self._meta_stream.close()
+        if self._meta_watcher != None:
+            self._meta_watcher.join(timeout=5)
+        self._meta_stream = None
+        self._meta_watcher = None
+        return self
+
+class SearchIndex:
+    """
+    An in-process inverted index over the books of a library, for searching without a round trip to the cluster.
+
+    Notes
+    -----
+    Every token of the indexed fields points to the books containing it and every three letter slice (trigram) of a token points to the tokens containing it, so exact, prefix and substring matches are all answered from memory. Matches are ranked with BM25. The index catches up with the books collection through the last_updated field that librarium.Library.add_book and librarium.Library.update_book set.
+
+    Example
+    -------
+
+        >>> index = librarium.SearchIndex(client)
+        >>> client.attach_index(index)
+        >>> info = client.search_books(
+            mode = "local",
+            name = ["trum"]
+        )
+
+    Attributes
+    ----------
+    refresh_interval : float
+        Seconds after which librarium.Library.search_books refreshes the index before answering
+
+    _library : librarium.Library
+        Library whose books are indexed
+
+    _weights : dict of str, float
+        Indexed fields and how much a token in each counts towards a book's score
+
+    _k1 : float
+        BM25 term frequency saturation
+
+    _b : float
+        BM25 length normalisation
+
+    _documents : dict of bson.objectid.ObjectId, dict
+        Indexed books
+
+    _postings : dict of str, dict of bson.objectid.ObjectId, dict of str, int
+        Books containing each token and how often it appears in each field
+
+    _lengths : dict of bson.objectid.ObjectId, float
+        Weighted number of tokens in each book
+
+    _total_length : float
+        Sum of _lengths
+
+    _trigrams : dict of str, set of str
+        Tokens containing each trigram
+
+    _sorted : None or list of str
+        Sorted tokens for prefix matching. Rebuilt when needed after tokens change
+
+    _watermark : None or datetime.datetime
+        Latest last_updated fetched by build or refresh. None if no such book had one
+
+    _refreshed : None or float
+        time.monotonic() of the last build or refresh
+    """
+    def __init__(self, library, weights=None, k1=1.2, b=0.75, refresh_interval=30):
+        if weights == None:
+            weights = {
+                "name": 3.0,
+                "authors": 2.0,
+                "genres": 1.0,
+                "publisher": 1.0,
+                "isbn": 1.0
+            }
+        self.refresh_interval = refresh_interval
+        self._library = library
+        self._weights = weights
+        self._k1 = k1
+        self._b = b
+        self._documents = {}
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0.0
+        self._trigrams = {}
+        self._sorted = None
+        self._watermark = None
+        self._refreshed = None
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __str__(self):
+        return f"librarium.SearchIndex(Books={len(self)}) at {hex(id(self))}"
+
+    def __repr__(self):
+        return f"librarium.SearchIndex(Books={len(self)}) at {hex(id(self))}"
+
+    def build(self):
+        """
+        Index every book in the library from scratch.
+
+        Example
+        -------
+
+            >>> index.build()
+            200000
+
+        Returns
+        -------
+        count : int
+            Number of books indexed
+        """
+        self._documents = {}
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0.0
+        self._trigrams = {}
+        self._sorted = None
+        self._watermark = None
+        for document in self._library._books.find({}):
+            self.add(document)
+            self._advance(document)
+        self._refreshed = time.monotonic()
+        return len(self)
+
+    def refresh(self, prune=False):
+        """
+        Index books added or updated since the last build or refresh.
+
+        Notes
+        -----
+        Only books whose last_updated is at or after the latest one already seen are fetched. Books deleted through another client are only noticed with prune, which fetches the _id of every book.
+
+        Example
+        -------
+
+            >>> index.refresh()
+            3
+
+        Parameters
+        ----------
+        prune : bool
+            Whether to also drop books that no longer exist
+
+        Returns
+        -------
+        count : int
+            Number of books indexed or reindexed
+        """
+        if self._refreshed == None:
+            return self.build()
+        if self._watermark == None:
+            query = {"last_updated": {"$type": "date"}}
+        else:
+            # Step back a little so writes from clients with slightly slow clocks are not missed
+            query = {"last_updated": {"$gte": self._watermark - datetime.timedelta(minutes=1)}}
+        count = 0
+        for document in self._library._books.find(query):
+            self.add(document)
+            self._advance(document)
+            count += 1
+        if prune:
+            existing = {x["_id"] for x in self._library._books.find({}, {"_id": 1})}
+            for objectid in list(self._documents):
+                if objectid not in existing:
+                    self.remove(objectid)
+        self._refreshed = time.monotonic()
+        return count
+
+    def stale(self):
+        """
+        Check whether the index is older than refresh_interval.
+
+        Returns
+        -------
+        stale : bool
+        """
+        if self._refreshed == None:
+            return True
+        return time.monotonic() - self._refreshed > self.refresh_interval
+
+    def add(self, document):
+        """
+        Index a book, replacing any earlier version of it.
+
+        Parameters
+        ----------
+        document : dict
+            Book document including _id
+        """
+        objectid = document["_id"]
+        if objectid in self._documents:
+            self.remove(objectid)
+        self._documents[objectid] = document
+        length = 0.0
+        for field, weight in self._weights.items():
+            for token in self._tokenize(field, document.get(field)):
+                if token not in self._postings:
+                    self._postings[token] = {}
+                    for trigram in self._trigrams_of(token):
+                        self._trigrams.setdefault(trigram, set()).add(token)
+                    self._sorted = None
+                counts = self._postings[token].setdefault(objectid, {})
+                counts[field] = counts.get(field, 0) + 1
+                length += weight
+        self._lengths[objectid] = length
+        self._total_length += length
+
+    def _advance(self, document):
+        """
+        Move the watermark up to the last_updated of a book fetched from the library.
+
+        Notes
+        -----
+        Books indexed through librarium.Library.add_book do not move the watermark, as books written by other clients in the meantime may still be older.
+
+        Parameters
+        ----------
+        document : dict
+            Book document as fetched by build or refresh
+        """
+        updated = document.get("last_updated")
+        if type(updated) == datetime.datetime:
+            updated = updated.replace(tzinfo=None)
+            if self._watermark == None or updated > self._watermark:
+                self._watermark = updated
+
+    def remove(self, objectid):
+        """
+        Drop a book from the index.
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            BSON ObjectId of book. Ignored if not indexed
+        """
+        document = self._documents.pop(objectid, None)
+        if document == None:
+            return
+        for field in self._weights:
+            for token in set(self._tokenize(field, document.get(field))):
+                postings = self._postings.get(token)
+                if postings == None:
+                    continue
+                postings.pop(objectid, None)
+                if postings != {}:
+                    continue
+                del self._postings[token]
+                for trigram in self._trigrams_of(token):
+                    tokens = self._trigrams.get(trigram)
+                    if tokens != None:
+                        tokens.discard(token)
+                        if tokens == set():
+                            del self._trigrams[trigram]
+                self._sorted = None
+        self._total_length -= self._lengths.pop(objectid)
+
+    def get(self, objectid):
+        """
+        Get an indexed book.
+
+        Parameters
+        ----------
+        objectid : bson.objectid.ObjectId
+            BSON ObjectId of book
+
+        Returns
+        -------
+        details : None or dict
+            Copy of the indexed book. None if not indexed
+        """
+        document = self._documents.get(objectid)
+        if document == None:
+            return None
+        return dict(document)
+
+    def search(self, text="", match="substring", limit=0, **terms):
+        """
+        Rank indexed books against free text and per-field terms.
+
+        Notes
+        -----
+        Every token of the query must match for a book to be returned. A token matching a longer indexed token only scores the fraction of it that it covers, so exact matches rank first.
+
+        Example
+        -------
+
+            >>> index.search("art deal", match="prefix", authors=["trump"])
+            [(ObjectId('...'), 7.31)]
+
+        Parameters
+        ----------
+        text : str
+            Free text matched against every indexed field
+
+        match : "exact", "prefix" or "substring"
+            How query tokens match indexed tokens
+
+        limit : int
+            Maximum number of results. No limit if 0
+
+        **terms : dict of str, list of str
+            Text matched against a single indexed field, such as name or isbn
+
+        Raises
+        ------
+        ValueError
+            If match is not one of the accepted modes or a term is for a field not indexed
+
+        Returns
+        -------
+        results : list of tuple of bson.objectid.ObjectId, float
+            ObjectIds of matching books with their scores, best first
+        """
+        if match not in ["exact", "prefix", "substring"]:
+            raise ValueError(
+                f"match is not 'exact', 'prefix' or 'substring': {match}"
+            )
+        fields = list(self._weights)
+        clauses = [(token, fields) for token in self._tokenize(None, text)]
+        for field, values in terms.items():
+            if field not in self._weights:
+                raise ValueError(f"field is not indexed: {field}")
+            if values == None:
+                continue
+            if type(values) != list:
+                values = [values]
+            for value in values:
+                for token in self._tokenize(field, value):
+                    clauses.append((token, [field]))
+        if clauses == []:
+            return [(objectid, 0.0) for objectid in self._documents][:limit or None]
+        total = len(self._documents)
+        average = self._total_length / total if total else 1.0
+        scores = None
+        for token, fields in clauses:
+            matched = {}
+            for candidate in self._candidates(token, match):
+                postings = self._postings[candidate]
+                idf = math.log(
+                    1 + (total - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                coverage = len(token) / len(candidate)
+                for objectid, counts in postings.items():
+                    frequency = sum(
+                        self._weights[field] * counts.get(field, 0)
+                        for field in fields
+                    )
+                    if frequency == 0:
+                        continue
+                    norm = self._k1 * (
+                        1 - self._b + self._b * self._lengths[objectid] / average
+                    )
+                    score = (
+                        coverage * idf * frequency * (self._k1 + 1) /
+                        (frequency + norm)
+                    )
+                    if score > matched.get(objectid, 0.0):
+                        matched[objectid] = score
+            if scores == None:
+                scores = matched
+            else:
+                scores = {
+                    objectid: score + matched[objectid]
+                    for objectid, score in scores.items()
+                    if objectid in matched
+                }
+            if scores == {}:
+                return []
+        results = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        return results[:limit or None]
+
+    def _tokenize(self, field, value):
+        """
+        Split a field value into lowercase word tokens.
+
+        Parameters
+        ----------
+        field : None or str
+            Field the value belongs to. Hyphens and spaces in an isbn are dropped so it stays one token
+
+        value : None, str, int or list
+            Value to split
+
+        Returns
+        -------
+        tokens : list of str
+        """
+        if value == None:
+            return []
+        if type(value) != list:
+            value = [value]
+        tokens = []
+        for item in value:
+            if item == None:
+                continue
+            text = str(item).lower()
+            if field == "isbn":
+                text = re.sub(r"[\s-]", "", text)
+            tokens += re.findall(r"\w+", text)
+        return tokens
+
+    def _trigrams_of(self, token):
+        """
+        Get the three letter slices of a token.
+
+        Parameters
+        ----------
+        token : str
+
+        Returns
+        -------
+        trigrams : set of str
+        """
+        return {token[i:i + 3] for i in range(len(token) - 2)}
+
+    def _candidates(self, token, match):
+        """
+        Find the indexed tokens a query token matches.
+
+        Parameters
+        ----------
+        token : str
+            Query token
+
+        match : "exact", "prefix" or "substring"
+            How the query token matches indexed tokens
+
+        Returns
+        -------
+        candidates : set of str
+        """
+        if match == "exact":
+            if token in self._postings:
+                return {token}
+            return set()
+        if match == "prefix":
+            if self._sorted == None:
+                self._sorted = sorted(self._postings)
+            candidates = set()
+            position = bisect.bisect_left(self._sorted, token)
+            while (position < len(self._sorted) and
+                   self._sorted[position].startswith(token)):
+                candidates.add(self._sorted[position])
+                position += 1
+            return candidates
+        if len(token) < 3:
+            return {x for x in self._postings if token in x}
+        tokens = sorted(
+            (self._trigrams.get(x, set()) for x in self._trigrams_of(token)),
+            key = len
+        )
+        candidates = set(tokens[0])
+        for other in tokens[1:]:
+            candidates &= other
+        return {x for x in candidates if token in x}
@@ -108,5 +108,15 @@ start = process_time()
 #print(client.get_meta())
 
 
+loans = client.search_loans(
+    expand = {"book": ["name"], "borrower": ["username"]},
+    returned = False
+)
+for loan in loans:
+    assert set(loan["book_data"].keys()) <= {"name"}, loan
+    assert set(loan["borrower_data"].keys()) <= {"username"}, loan
+iprint.pprint(loans)
+
+
 iprint.pprint(f"Time taken: {process_time()-start}s")
 client.disconnect()